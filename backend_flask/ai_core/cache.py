@@ -0,0 +1,232 @@
+# backend_flask/ai_core/cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from flask import current_app
+
+AI_CACHE_DB_FILENAME = os.getenv("AI_CACHE_DB", "ai_cache.sqlite3") # Relative to backend_flask; "" disables the shared tier
+
+def make_cache_key(*parts):
+    """Stable SHA-256 key over JSON-serializable parts."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+def normalize_text(text):
+    """Case- and whitespace-insensitive form of a prompt, used for cache keys."""
+    return " ".join(str(text or "").lower().split())
+
+
+class TTLCache:
+    """Thread-safe in-memory LRU cache whose entries expire after `ttl_seconds`."""
+
+    def __init__(self, max_entries=1024, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl_seconds=None):
+        expires_at = time.time() + (ttl_seconds or self.ttl_seconds)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCacheStore:
+    """
+    Persistent cache tier in a standalone SQLite file, shared by every worker process.
+    Values are JSON. Each namespace is capped at `max_entries`, evicting least recently used.
+    """
+
+    def __init__(self, db_path, namespace, max_entries=10_000):
+        self.db_path = db_path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes_since_evict = 0
+        self._writes_lock = threading.Lock()
+        _sqlite_stores.add(self)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    cache_key TEXT NOT NULL,
+                    value_json TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (namespace, cache_key)
+                )""")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_entries_lru ON cache_entries (namespace, last_access)")
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        conn = self._connection()
+        now = time.time()
+        row = conn.execute("SELECT value_json FROM cache_entries WHERE namespace = ? AND cache_key = ? AND expires_at > ?",
+                           (self.namespace, key, now)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE cache_entries SET last_access = ? WHERE namespace = ? AND cache_key = ?", (now, self.namespace, key))
+        conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl_seconds):
+        conn = self._connection()
+        now = time.time()
+        conn.execute("""
+            INSERT INTO cache_entries (namespace, cache_key, value_json, expires_at, last_access) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(namespace, cache_key) DO UPDATE SET
+                value_json = excluded.value_json, expires_at = excluded.expires_at, last_access = excluded.last_access
+        """, (self.namespace, key, json.dumps(value), now + ttl_seconds, now))
+        conn.commit()
+        with self._writes_lock:
+            self._writes_since_evict += 1
+            due = self._writes_since_evict >= 100 # Amortize eviction instead of counting rows on every write
+            if due:
+                self._writes_since_evict = 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        conn = self._connection()
+        conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND expires_at <= ?", (self.namespace, time.time()))
+        conn.execute("""
+            DELETE FROM cache_entries WHERE namespace = ? AND cache_key IN (
+                SELECT cache_key FROM cache_entries WHERE namespace = ?
+                ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )""", (self.namespace, self.namespace, self.max_entries))
+        conn.commit()
+
+_sqlite_stores = weakref.WeakSet()
+
+def _reset_connections_after_fork():
+    # The forking thread keeps its thread-local connection in the child; SQLite connections must not
+    # be used across processes, so every store reconnects on first use in a forked worker.
+    for store in list(_sqlite_stores):
+        store._local = threading.local()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_connections_after_fork)
+
+
+class TieredCache:
+    """
+    In-memory TTLCache in front of an optional SQLiteCacheStore, with hit/miss counters.
+    The shared tier is opened lazily (it needs the app root path) and disabled on any SQLite error.
+    """
+
+    def __init__(self, namespace, max_entries=1024, ttl_seconds=3600, persistent=True, persistent_max_entries=10_000):
+        self.namespace = namespace
+        self.memory = TTLCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.ttl_seconds = ttl_seconds
+        self.persistent = persistent and bool(AI_CACHE_DB_FILENAME)
+        self.persistent_max_entries = persistent_max_entries
+        self._store = None
+        self._store_lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "persistent_hits": 0, "misses": 0, "stores": 0, "errors": 0}
+        self._stats_lock = threading.Lock() # Request and pipeline threads update the counters concurrently
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _persistent_store(self):
+        if not self.persistent:
+            return None
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    db_path = os.path.join(current_app.root_path, AI_CACHE_DB_FILENAME)
+                    self._store = SQLiteCacheStore(db_path, self.namespace, max_entries=self.persistent_max_entries)
+        return self._store
+
+    def _disable_persistent(self, e):
+        self._count("errors")
+        self.persistent = False
+        current_app.logger.error(f"Disabling shared '{self.namespace}' cache tier after SQLite error: {e}")
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+        store = self._persistent_store()
+        if store is not None:
+            try:
+                value = store.get(key)
+            except sqlite3.Error as e:
+                self._disable_persistent(e)
+                value = None
+            if value is not None:
+                self._count("persistent_hits")
+                self.memory.set(key, value)
+                return value
+        self._count("misses")
+        return None
+
+    def peek(self, key):
+        """Like get(), but not counted in the hit/miss stats and not promoted into memory (for read-modify-write)."""
+        value = self.memory.get(key)
+        if value is not None:
+            return value
+        store = self._persistent_store()
+        if store is not None:
+            try:
+                return store.get(key)
+            except sqlite3.Error as e:
+                self._disable_persistent(e)
+        return None
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        self._count("stores")
+        store = self._persistent_store()
+        if store is not None:
+            try:
+                store.set(key, value, self.ttl_seconds)
+            except sqlite3.Error as e:
+                self._disable_persistent(e)
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        lookups = stats["memory_hits"] + stats["persistent_hits"] + stats["misses"]
+        hits = lookups - stats["misses"]
+        return {**stats, "memory_entries": len(self.memory), "persistent_enabled": self.persistent,
+                "hit_rate": (hits / lookups) if lookups else 0.0}
@@ -0,0 +1,84 @@
+# backend_flask/ai_core/catalog_features.py
+import numpy as np
+
+# Preference weights (unchanged from the per-product scorer)
+LIKED_COLOR_WEIGHT = 0.7 # Per like of a color the product is tagged with
+INTERACTED_CATEGORY_BOOST = 2.5
+
+def _normalize(value):
+    return str(value or "").strip().lower()
+
+
+class CategoricalColumn:
+    """One value per product, encoded once as an integer code per row (-1 for empty)."""
+
+    def __init__(self, values):
+        self.vocabulary = {} # normalized value -> code
+        codes = np.full(len(values), -1, dtype=np.int32)
+        for row, value in enumerate(values):
+            value = _normalize(value)
+            if value:
+                codes[row] = self.vocabulary.setdefault(value, len(self.vocabulary))
+        self.codes = codes
+
+    def mask(self, values):
+        """Boolean (N,) array: rows whose value is any of `values` (case-insensitive)."""
+        wanted = [self.vocabulary[v] for v in map(_normalize, values) if v in self.vocabulary]
+        if not wanted:
+            return np.zeros(len(self.codes), dtype=bool)
+        return np.isin(self.codes, wanted)
+
+
+class MultiValueColumn:
+    """
+    A tag list per product as a sparse one-hot matrix in coordinate form:
+    entry i says product rows[i] has tag codes[i]. Duplicate tags on a product are stored once.
+    """
+
+    def __init__(self, value_lists):
+        self.vocabulary = {}
+        rows, codes = [], []
+        for row, values in enumerate(value_lists):
+            for code in {self.vocabulary.setdefault(v, len(self.vocabulary)) for v in map(_normalize, values or []) if v}:
+                rows.append(row)
+                codes.append(code)
+        self.num_rows = len(value_lists)
+        self.rows = np.array(rows, dtype=np.int32)
+        self.codes = np.array(codes, dtype=np.int32)
+
+    def weighted_sum(self, weight_by_value):
+        """(N,) array: for each product, the sum of weights of the tags it has (one-hot matrix times weight vector)."""
+        weights = np.zeros(len(self.vocabulary), dtype=np.float64)
+        for value, weight in weight_by_value.items():
+            code = self.vocabulary.get(_normalize(value))
+            if code is not None:
+                weights[code] += weight
+        if not weights.any():
+            return np.zeros(self.num_rows, dtype=np.float64)
+        return np.bincount(self.rows, weights=weights[self.codes], minlength=self.num_rows)
+
+
+class CatalogFeatures:
+    """
+    Columnar encoding of the catalog attributes the recommender scores on (color tags, category),
+    built once per catalog load.
+    Rows are positions in the product list it was built from.
+    """
+
+    def __init__(self, products):
+        self.num_products = len(products)
+        self.colors = MultiValueColumn([p.get("color_tags") or [] for p in products])
+        self.category = CategoricalColumn([p.get("category") for p in products])
+
+    def preference_scores(self, user_preferences):
+        """(N,) preference boost for every product: liked color tags plus interacted categories."""
+        scores = np.zeros(self.num_products, dtype=np.float64)
+        if not user_preferences:
+            return scores
+        liked_colors = user_preferences.get("liked_colors", {})
+        if liked_colors:
+            scores += self.colors.weighted_sum({color: count * LIKED_COLOR_WEIGHT for color, count in liked_colors.items()})
+        interacted_categories = user_preferences.get("interacted_categories", [])
+        if interacted_categories:
+            scores += INTERACTED_CATEGORY_BOOST * self.category.mask(interacted_categories)
+        return scores
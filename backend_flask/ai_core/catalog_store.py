@@ -0,0 +1,59 @@
+# backend_flask/ai_core/catalog_store.py
+import sys
+
+EXCLUDED_FIELDS = ("embedding",) # Embeddings live only in product_catalog's shared matrix
+_MISSING = object() # Field absent from this product's JSON record (left out of its views)
+
+def _compact(value):
+    """Interns strings (repeated values such as "Apparel" or "Men" share one object) and freezes lists."""
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, list):
+        return tuple(_compact(v) for v in value)
+    return value
+
+def _thaw(value):
+    return list(value) if isinstance(value, tuple) else value
+
+
+class CatalogStore:
+    """
+    The product catalog as one column per field (struct of arrays) instead of one dict per product.
+    Products are addressed by position. catalog[position] materializes a fresh dict view of one product,
+    so callers may annotate it freely; only the products a request actually returns are ever materialized.
+    """
+
+    __slots__ = ("fields", "columns", "ids", "positions_by_id")
+
+    def __init__(self, products=()):
+        fields = {}
+        for product in products:
+            fields.update(dict.fromkeys(k for k in product if k not in EXCLUDED_FIELDS))
+        self.fields = tuple(fields)
+        self.columns = {field: [_compact(product.get(field, _MISSING)) for product in products] for field in self.fields}
+        self.ids = [sys.intern(str(product.get("id"))) for product in products]
+        self.positions_by_id = {product_id: position for position, product_id in enumerate(self.ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, position):
+        view = {}
+        for field in self.fields:
+            value = self.columns[field][position]
+            if value is not _MISSING:
+                view[field] = _thaw(value)
+        return view
+
+    def __iter__(self):
+        return (self[position] for position in range(len(self)))
+
+    def value(self, position, field, default=None):
+        column = self.columns.get(field)
+        if column is None or column[position] is _MISSING:
+            return default
+        return _thaw(column[position])
+
+    def position_of(self, product_id):
+        """Catalog position of a product id (int or str), or None."""
+        return self.positions_by_id.get(str(product_id))
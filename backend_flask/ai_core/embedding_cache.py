@@ -0,0 +1,226 @@
+# backend_flask/ai_core/embedding_cache.py
+import hashlib
+import json
+import os
+import shutil
+import time
+import numpy as np
+from flask import current_app
+
+EMBEDDING_CACHE_DIR = "embedding_cache" # Relative to backend_flask
+EMBEDDING_MATRIX_FILE = "vit_embeddings.npy" # Saves write vit_embeddings.<generation>.npy; the manifest names the current one
+EMBEDDING_MATRIX_RETENTION_SECONDS = 600 # Superseded matrix files older than this are removed on the next save
+EMBEDDING_MANIFEST_FILE = "vit_manifest.json"
+MANIFEST_VERSION = 1
+# The catalog's search matrix is served from read-only memmaps of these files, so every worker process maps
+# one copy from the page cache instead of holding its own. "false" keeps the matrix in process memory.
+SHARED_CATALOG_MATRIX = os.getenv("SHARED_CATALOG_MATRIX", "true").lower() == "true"
+CATALOG_MATRIX_DIR = "catalog_matrix" # Under EMBEDDING_CACHE_DIR, one subdirectory per matrix content hash
+CATALOG_MATRIX_RETENTION_SECONDS = 600 # Unused matrix directories older than this are removed
+CATALOG_MATRIX_FILES = ("matrix.npy", "ids.npy", "positions.npy")
+
+def get_cache_dir():
+    return os.path.join(current_app.root_path, EMBEDDING_CACHE_DIR)
+
+def hash_image_file(image_path, chunk_size=1 << 16):
+    """Returns the SHA-1 hex digest of an image file's bytes."""
+    digest = hashlib.sha1()
+    with open(image_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def image_fingerprint(image_path, cached_entry=None):
+    """
+    Returns (sha1, size, mtime_ns) for an image. If the file's size and mtime match the
+    cached entry we trust its stored hash and skip re-reading the file.
+    """
+    stat = os.stat(image_path)
+    if cached_entry and cached_entry.get("size") == stat.st_size and cached_entry.get("mtime_ns") == stat.st_mtime_ns:
+        return cached_entry["sha1"], stat.st_size, stat.st_mtime_ns
+    return hash_image_file(image_path), stat.st_size, stat.st_mtime_ns
+
+def matrix_digest(matrix):
+    """SHA-1 of a matrix's bytes, recorded in the manifest for the offline verify_embedding_cache() check."""
+    return hashlib.sha1(np.ascontiguousarray(matrix)).hexdigest()
+
+def _read_manifest(cache_dir):
+    with open(os.path.join(cache_dir, EMBEDDING_MANIFEST_FILE), "r") as f:
+        return json.load(f)
+
+def _manifest_matrix_path(cache_dir, manifest):
+    # Manifests written before generation-named matrices point at the fixed EMBEDDING_MATRIX_FILE
+    return os.path.join(cache_dir, manifest.get("matrix_file") or EMBEDDING_MATRIX_FILE)
+
+def load_embedding_cache(model_name):
+    """
+    Loads the on-disk embedding cache.
+    Returns (manifest_entries, matrix) where manifest_entries maps product id -> entry dict
+    ({"row", "sha1", "size", "mtime_ns"}) and matrix is a read-only memmap of shape (N, dim).
+    Returns ({}, None) if the cache is missing, corrupt, or was built with another model.
+    The matrix is checked against the manifest by file name, size, shape and dtype only, so loading stays
+    lazy; verify_embedding_cache() compares the full contents.
+    """
+    cache_dir = get_cache_dir()
+    manifest_path = os.path.join(cache_dir, EMBEDDING_MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        current_app.logger.info(f"No embedding cache found at {cache_dir}. All products will be embedded.")
+        return {}, None
+
+    try:
+        manifest = _read_manifest(cache_dir)
+        if manifest.get("version") != MANIFEST_VERSION or manifest.get("model_name") != model_name:
+            current_app.logger.info(f"Embedding cache was built for model '{manifest.get('model_name')}' "
+                                    f"(version {manifest.get('version')}); current model is '{model_name}'. Ignoring cache.")
+            return {}, None
+        matrix_path = _manifest_matrix_path(cache_dir, manifest)
+        if manifest.get("matrix_file"):
+            # Each save writes a new generation-named matrix and then swaps in the manifest naming it,
+            # so a manifest and the file it names always belong to the same save
+            paired = os.path.getsize(matrix_path) == manifest.get("matrix_bytes")
+        else:
+            # Legacy layout: both files are replaced in place, matrix first
+            paired = os.path.getmtime(matrix_path) <= os.path.getmtime(manifest_path)
+        if not paired:
+            current_app.logger.warning("Embedding cache matrix does not match its manifest (caught mid-save by another worker?). Ignoring cache.")
+            return {}, None
+        matrix = np.load(matrix_path, mmap_mode="r")
+        entries = manifest.get("products", {})
+        if (matrix.ndim != 2 or matrix.shape[0] != manifest.get("rows")
+                or matrix.shape[1] != manifest.get("dim", matrix.shape[1]) or matrix.dtype.str != manifest.get("dtype", matrix.dtype.str)):
+            current_app.logger.warning("Embedding cache manifest does not match matrix shape. Ignoring cache.")
+            return {}, None
+        current_app.logger.info(f"Loaded embedding cache: {len(entries)} entries, matrix shape {matrix.shape}.")
+        return entries, matrix
+    except (OSError, ValueError, json.JSONDecodeError) as e:
+        current_app.logger.warning(f"Could not read embedding cache ({e}). Ignoring cache.")
+        return {}, None
+
+def verify_embedding_cache():
+    """
+    Offline check that the cached matrix bytes hash to the manifest's matrix_sha1 (reads the whole matrix).
+    Returns True if they match, False on a mismatch, None if the cache or its digest is missing.
+    """
+    cache_dir = get_cache_dir()
+    try:
+        manifest = _read_manifest(cache_dir)
+        if not manifest.get("matrix_sha1"):
+            return None
+        return matrix_digest(np.load(_manifest_matrix_path(cache_dir, manifest), mmap_mode="r")) == manifest["matrix_sha1"]
+    except (OSError, ValueError, json.JSONDecodeError):
+        return None
+
+def _remove_old_matrix_files(cache_dir, keep_name):
+    # Workers that read the previous manifest may still be about to open its matrix, so files are kept a while
+    cutoff = time.time() - EMBEDDING_MATRIX_RETENTION_SECONDS
+    matrix_stem = os.path.splitext(EMBEDDING_MATRIX_FILE)[0]
+    for name in os.listdir(cache_dir):
+        if name == keep_name or not name.startswith(matrix_stem) or not name.endswith(".npy"):
+            continue
+        path = os.path.join(cache_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+def save_embedding_cache(model_name, products):
+    """
+    Writes the embedding cache atomically.
+    `products` maps product id -> {"embedding": np.ndarray, "sha1", "size", "mtime_ns"}.
+    """
+    if not products:
+        return
+    cache_dir = get_cache_dir()
+    os.makedirs(cache_dir, exist_ok=True)
+
+    product_ids = list(products.keys())
+    matrix = np.vstack([np.asarray(products[pid]["embedding"], dtype=np.float32) for pid in product_ids])
+    # The matrix of every save gets its own file; swapping in the manifest that names it is the one commit step
+    generation = f"{time.time_ns()}-{os.getpid()}"
+    matrix_name = f"{os.path.splitext(EMBEDDING_MATRIX_FILE)[0]}.{generation}.npy"
+    matrix_path = os.path.join(cache_dir, matrix_name)
+    manifest_path = os.path.join(cache_dir, EMBEDDING_MANIFEST_FILE)
+    tmp_suffix = f".tmp{os.getpid()}"
+    try:
+        with open(matrix_path + tmp_suffix, "wb") as f:
+            np.save(f, matrix)
+        os.replace(matrix_path + tmp_suffix, matrix_path)
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "model_name": model_name,
+            "matrix_file": matrix_name,
+            "matrix_bytes": os.path.getsize(matrix_path),
+            "dtype": matrix.dtype.str,
+            "dim": int(matrix.shape[1]),
+            "rows": int(matrix.shape[0]),
+            "matrix_sha1": matrix_digest(matrix),
+            "products": {
+                pid: {"row": row, "sha1": products[pid]["sha1"],
+                      "size": products[pid]["size"], "mtime_ns": products[pid]["mtime_ns"]}
+                for row, pid in enumerate(product_ids)
+            },
+        }
+        with open(manifest_path + tmp_suffix, "w") as f:
+            json.dump(manifest, f)
+        os.replace(manifest_path + tmp_suffix, manifest_path)
+        current_app.logger.info(f"Saved embedding cache with {len(product_ids)} entries to {cache_dir}.")
+        _remove_old_matrix_files(cache_dir, matrix_name)
+    except OSError as e:
+        current_app.logger.error(f"Failed to save embedding cache: {e}")
+        for tmp_path in (matrix_path + tmp_suffix, manifest_path + tmp_suffix):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def _map_catalog_arrays(matrix_dir):
+    # Plain ndarray views keep the mapping alive without np.memmap's per-slice overhead
+    return tuple(np.load(os.path.join(matrix_dir, name), mmap_mode="r").view(np.ndarray) for name in CATALOG_MATRIX_FILES)
+
+def _remove_old_catalog_matrices(root_dir, keep_name):
+    # Processes that still map a removed directory keep reading it; the files go away with their last mapping
+    cutoff = time.time() - CATALOG_MATRIX_RETENTION_SECONDS
+    for name in os.listdir(root_dir):
+        path = os.path.join(root_dir, name)
+        try:
+            if name != keep_name and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            pass
+
+def share_catalog_matrix(matrix, ids, positions):
+    """
+    Returns the catalog search arrays (normalized embedding matrix, product ids, catalog positions) as
+    read-only memmaps of files under embedding_cache/catalog_matrix/<content hash>/.
+    Workers forked from a preloaded app inherit the mapping, and workers that build the same catalog on
+    their own map the same files, so the page cache holds a single copy for all of them. Returns the
+    arrays unchanged, plus None as the path, when sharing is disabled or the files cannot be written.
+    """
+    arrays = (np.ascontiguousarray(matrix, dtype=np.float32), np.asarray(ids), np.asarray(positions, dtype=np.int64))
+    if not SHARED_CATALOG_MATRIX:
+        return (*arrays, None)
+    digest = hashlib.sha1()
+    for array in arrays:
+        digest.update(f"{array.dtype.str}{array.shape}".encode("utf-8"))
+        digest.update(array.tobytes())
+    root_dir = os.path.join(get_cache_dir(), CATALOG_MATRIX_DIR)
+    matrix_dir = os.path.join(root_dir, digest.hexdigest())
+    tmp_dir = f"{matrix_dir}.tmp{os.getpid()}"
+    try:
+        if not os.path.isdir(matrix_dir):
+            os.makedirs(tmp_dir, exist_ok=True)
+            for name, array in zip(CATALOG_MATRIX_FILES, arrays):
+                np.save(os.path.join(tmp_dir, name), array)
+            try:
+                os.rename(tmp_dir, matrix_dir)
+            except OSError: # Another worker published the same matrix first
+                if not os.path.isdir(matrix_dir):
+                    raise
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.utime(matrix_dir) # Marks it in use for _remove_old_catalog_matrices
+        shared = _map_catalog_arrays(matrix_dir)
+        _remove_old_catalog_matrices(root_dir, os.path.basename(matrix_dir))
+        return (*shared, matrix_dir)
+    except (OSError, ValueError) as e:
+        current_app.logger.warning(f"Could not map the catalog matrix from {matrix_dir} ({e}). Keeping it in process memory.")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return (*arrays, None)
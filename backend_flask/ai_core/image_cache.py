@@ -0,0 +1,143 @@
+# backend_flask/ai_core/image_cache.py
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image
+from flask import current_app
+from .cache import TieredCache
+from .vision_models import VIT_MODEL_NAME, VIT_EMBEDDING_SPACE
+
+# Optional near-duplicate matching: uploads whose 64-bit difference hash is within this Hamming distance
+# of a cached image (re-encoded/resized copies of the same social media photo) reuse its description.
+# The dHash is grayscale, so the colors must also match; the ViT embedding is always recomputed.
+NEAR_DUPLICATE_MATCHING = os.getenv("IMAGE_CACHE_NEAR_DUPLICATES", "0") != "0"
+PHASH_MAX_DISTANCE = int(os.getenv("IMAGE_CACHE_PHASH_MAX_DISTANCE", "4"))
+COLOR_MIN_SIMILARITY = float(os.getenv("IMAGE_CACHE_COLOR_MIN_SIMILARITY", "0.9")) # Histogram intersection, 0..1
+PHASH_SCAN_LIMIT = 4096 # Recent hashes kept per worker for Hamming-distance scans
+COLOR_HISTOGRAM_BINS = 4 # Per RGB channel
+
+def difference_hash(image):
+    """64-bit dHash of a PIL image: compares horizontally adjacent pixels of a 9x8 grayscale thumbnail."""
+    pixels = np.asarray(image.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def color_histogram(image):
+    """Normalized joint RGB histogram (COLOR_HISTOGRAM_BINS per channel) of a 32x32 thumbnail, as a list."""
+    pixels = np.asarray(image.convert("RGB").resize((32, 32), Image.BILINEAR), dtype=np.int32)
+    bins = pixels * COLOR_HISTOGRAM_BINS // 256
+    codes = (bins[..., 0] * COLOR_HISTOGRAM_BINS + bins[..., 1]) * COLOR_HISTOGRAM_BINS + bins[..., 2]
+    counts = np.bincount(codes.ravel(), minlength=COLOR_HISTOGRAM_BINS ** 3)
+    return [round(float(c), 4) for c in counts / counts.sum()]
+
+def colors_match(histogram, other_histogram):
+    if not histogram or not other_histogram or len(histogram) != len(other_histogram):
+        return False
+    return float(np.minimum(histogram, other_histogram).sum()) >= COLOR_MIN_SIMILARITY
+
+def _encode_embedding(embedding):
+    return base64.b64encode(np.asarray(embedding, dtype=np.float32).tobytes()).decode("ascii")
+
+def _decode_embedding(encoded):
+    return np.frombuffer(base64.b64decode(encoded), dtype=np.float32).copy()
+
+
+class ImageAnalysisCache:
+    """
+    Content-addressed cache of per-image AI results (OpenAI description, ViT query embedding).
+    Entries are keyed by SHA-256 of the image bytes and stored in a TieredCache (memory + shared SQLite,
+    LRU-evicted). With near-duplicate matching on, a perceptual-hash side index maps an upload onto an
+    existing entry; only that entry's description is reused, and only if the color histograms also match.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=7 * 24 * 3600, persistent_max_entries=20_000):
+        self.entries = TieredCache("image_analysis", max_entries=max_entries, ttl_seconds=ttl_seconds,
+                                   persistent_max_entries=persistent_max_entries)
+        self.phash_to_key = TieredCache("image_phash", max_entries=max_entries, ttl_seconds=ttl_seconds,
+                                        persistent_max_entries=persistent_max_entries)
+        self._recent_phashes = OrderedDict() # phash int -> content key, for Hamming-distance scans
+        self._lock = threading.Lock()
+        self._merge_lock = threading.Lock() # The describe and visual stages store results for the same image concurrently
+        self.near_duplicate_hits = 0
+
+    def compute_keys(self, image_bytes, pil_image=None):
+        """Returns {"sha256": hex, "phash": int or None, "colors": histogram or None} for the raw upload bytes."""
+        keys = {"sha256": hashlib.sha256(image_bytes).hexdigest(), "phash": None, "colors": None}
+        if NEAR_DUPLICATE_MATCHING:
+            try:
+                image = pil_image if pil_image is not None else Image.open(io.BytesIO(image_bytes))
+                keys["phash"], keys["colors"] = difference_hash(image), color_histogram(image)
+            except Exception as e:
+                current_app.logger.warning(f"Could not compute perceptual hash for upload: {e}")
+        return keys
+
+    def _find_near_duplicate(self, phash):
+        exact = self.phash_to_key.get(format(phash, "016x"))
+        if exact is not None:
+            return exact
+        with self._lock:
+            candidates = list(self._recent_phashes.items())
+        best_key, best_distance = None, PHASH_MAX_DISTANCE + 1
+        for other_phash, content_key in candidates:
+            distance = bin(phash ^ other_phash).count("1")
+            if distance < best_distance:
+                best_key, best_distance = content_key, distance
+        return best_key
+
+    def lookup(self, keys):
+        """
+        Returns a dict with any cached "description" and "embedding" (np.ndarray) for the image; {} on a miss.
+        A near-duplicate hit returns the description only: the embedding is computed from the upload itself.
+        """
+        entry = self.entries.get(keys["sha256"])
+        if entry is None and keys.get("phash") is not None:
+            near_key = self._find_near_duplicate(keys["phash"])
+            near_entry = self.entries.get(near_key) if near_key is not None else None
+            if near_entry and near_entry.get("description") and colors_match(keys.get("colors"), near_entry.get("colors")):
+                with self._lock:
+                    self.near_duplicate_hits += 1
+                current_app.logger.info("Image description served from a near-duplicate cached upload.")
+                return {"description": near_entry["description"]}
+            return {}
+        if not entry:
+            return {}
+        result = {"description": entry.get("description")}
+        # Entries written before inference modes existed hold fp32 embeddings
+        if entry.get("embedding_b64") and entry.get("embedding_space", VIT_MODEL_NAME) == VIT_EMBEDDING_SPACE:
+            result["embedding"] = _decode_embedding(entry["embedding_b64"])
+        return result
+
+    def store(self, keys, description=None, embedding=None):
+        """Merges new results into the image's entry. Pass only successful results."""
+        if description is None and embedding is None:
+            return
+        updates = {}
+        if description is not None:
+            updates["description"] = description
+        if embedding is not None:
+            updates["embedding_b64"] = _encode_embedding(embedding)
+            updates["embedding_space"] = VIT_EMBEDDING_SPACE
+        if keys.get("colors") is not None:
+            updates["colors"] = keys["colors"]
+        with self._merge_lock:
+            entry = dict(self.entries.peek(keys["sha256"]) or {})
+            entry.update(updates)
+            self.entries.set(keys["sha256"], entry)
+
+        if keys.get("phash") is not None:
+            self.phash_to_key.set(format(keys["phash"], "016x"), keys["sha256"])
+            with self._lock:
+                self._recent_phashes[keys["phash"]] = keys["sha256"]
+                self._recent_phashes.move_to_end(keys["phash"])
+                while len(self._recent_phashes) > PHASH_SCAN_LIMIT:
+                    self._recent_phashes.popitem(last=False)
+
+    def get_stats(self):
+        return {"entries": self.entries.get_stats(), "near_duplicate_hits": self.near_duplicate_hits}
+
+
+image_analysis_cache = ImageAnalysisCache()
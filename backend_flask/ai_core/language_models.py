@@ -1,46 +1,110 @@
 # backend_flask/ai_core/language_models.py
 import os
 import json
-import google.generativeai as genai
-import spacy
+import threading
+from functools import lru_cache
 from flask import current_app
+from .cache import TieredCache, make_cache_key, normalize_text
 
-# spaCy Model Loading (Load once)
+GEMINI_MODEL_NAME = "gemini-1.5-flash-latest" # Or "gemini-1.5-pro-latest"
+
+# Gemini refinement responses, keyed by normalized inputs + model name.
+# In-memory LRU per worker, backed by a SQLite tier shared by all workers (see cache.py).
+gemini_response_cache = TieredCache(
+    "gemini_refinement",
+    max_entries=int(os.getenv("GEMINI_CACHE_MAX_ENTRIES", "1024")),
+    ttl_seconds=int(os.getenv("GEMINI_CACHE_TTL_SECONDS", "3600")),
+    persistent=os.getenv("GEMINI_CACHE_PERSISTENT", "1") != "0",
+)
+
+# spaCy Model Loading (Load once). spacy and google.generativeai are imported on first use:
+# both are slow to import and most routes never touch them.
 nlp_spacy = None
+_spacy_load_lock = threading.Lock()
+SPACY_MODEL_NAME = "en_core_web_sm" # Small English model
+# Keyword extraction only reads POS tags (tagger + attribute_ruler), lemmas and entities; the dependency
+# parser is the slowest component of the pipeline and is never loaded.
+SPACY_EXCLUDED_COMPONENTS = ["parser", "senter"]
+SPACY_CACHE_MAX_ENTRIES = int(os.getenv("SPACY_CACHE_MAX_ENTRIES", "4096"))
+KEYWORD_POS_TAGS = {"NOUN", "PROPN", "ADJ"}
+KEYWORD_ENTITY_LABELS = {"PRODUCT", "ORG", "WORK_OF_ART"}
 
 def load_spacy_model():
     global nlp_spacy
-    if nlp_spacy is None:
-        try:
-            current_app.logger.info("Loading spaCy model (en_core_web_sm)...")
-            nlp_spacy = spacy.load("en_core_web_sm") # Small English model
-            current_app.logger.info("spaCy model loaded successfully.")
-        except OSError: # Model not downloaded
-            current_app.logger.warning("spaCy model 'en_core_web_sm' not found. Please download it by running: python -m spacy download en_core_web_sm")
-            current_app.logger.warning("spaCy NLP features will be limited.")
-        except Exception as e:
-            current_app.logger.error(f"Error loading spaCy model: {e}")
+    if nlp_spacy is not None:
+        return nlp_spacy
+    with _spacy_load_lock:
+        if nlp_spacy is None:
+            try:
+                import spacy
+                current_app.logger.info(f"Loading spaCy model ({SPACY_MODEL_NAME})...")
+                nlp_spacy = spacy.load(SPACY_MODEL_NAME, exclude=SPACY_EXCLUDED_COMPONENTS)
+                current_app.logger.info(f"spaCy model loaded successfully (components: {', '.join(nlp_spacy.pipe_names)}).")
+            except OSError: # Model not downloaded
+                current_app.logger.warning("spaCy model 'en_core_web_sm' not found. Please download it by running: python -m spacy download en_core_web_sm")
+                current_app.logger.warning("spaCy NLP features will be limited.")
+            except Exception as e:
+                current_app.logger.error(f"Error loading spaCy model: {e}")
     return nlp_spacy
 
-def extract_keywords_spacy(text):
-    nlp = load_spacy_model()
-    if not nlp or not text:
-        return []
-    
-    doc = nlp(text.lower())
+def _keywords_from_doc(doc):
     keywords = set()
     for token in doc:
-        if token.pos_ in ["NOUN", "PROPN", "ADJ"] and not token.is_stop and len(token.lemma_) > 2:
+        if token.pos_ in KEYWORD_POS_TAGS and not token.is_stop and len(token.lemma_) > 2:
             keywords.add(token.lemma_)
     for ent in doc.ents:
-        if ent.label_ in ["PRODUCT", "ORG", "WORK_OF_ART"]:
+        if ent.label_ in KEYWORD_ENTITY_LABELS:
             keywords.add(ent.text.lower())
-            
-    current_app.logger.info(f"spaCy extracted keywords: {list(keywords)} from text (snippet): {text[:50]}...")
-    return list(keywords)
+    return tuple(sorted(keywords))
+
+@lru_cache(maxsize=SPACY_CACHE_MAX_ENTRIES)
+def _cached_prompt_keywords(normalized_text):
+    return _keywords_from_doc(nlp_spacy(normalized_text))
+
+def extract_keywords_spacy(text):
+    """Lemmatized keywords (nouns, proper nouns, adjectives) and product-like entities of one prompt, LRU-cached."""
+    nlp = load_spacy_model()
+    normalized_text = normalize_text(text) # Prompts differing only in case or whitespace share a cache entry
+    if not nlp or not normalized_text:
+        return []
+    keywords = list(_cached_prompt_keywords(normalized_text))
+    current_app.logger.debug(f"spaCy extracted keywords: {keywords} from text (snippet): {normalized_text[:50]}...")
+    return keywords
+
+def extract_keywords_spacy_batch(texts, batch_size=256, n_process=1):
+    """
+    Keywords for many texts in one nlp.pipe pass, in the same lemma space as extract_keywords_spacy.
+    For offline jobs and catalog preprocessing; results bypass the prompt cache.
+    """
+    nlp = load_spacy_model()
+    if not nlp:
+        return [[] for _ in texts]
+    docs = nlp.pipe((normalize_text(text) for text in texts), batch_size=batch_size, n_process=n_process)
+    return [list(_keywords_from_doc(doc)) for doc in docs]
+
+def get_spacy_cache_stats():
+    info = _cached_prompt_keywords.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "entries": info.currsize, "max_entries": info.maxsize}
 
 
 def get_refined_search_gemini(image_description, user_prompt, product_context_str=""):
+    """Gemini query refinement, served from gemini_response_cache when the same inputs were seen recently."""
+    cache_key = make_cache_key(GEMINI_MODEL_NAME, normalize_text(image_description),
+                               normalize_text(user_prompt), normalize_text(product_context_str))
+    cached = gemini_response_cache.get(cache_key)
+    if cached is not None:
+        current_app.logger.debug("Gemini refinement served from cache.")
+        return dict(cached)
+
+    gemini_output = _request_gemini_refinement(image_description, user_prompt, product_context_str)
+    if isinstance(gemini_output, dict) and not gemini_output.get("error"): # Never cache failures
+        gemini_response_cache.set(cache_key, gemini_output)
+    return gemini_output
+
+def get_gemini_cache_stats():
+    return gemini_response_cache.get_stats()
+
+def _request_gemini_refinement(image_description, user_prompt, product_context_str=""):
     # Corrected: Remove the genai._configured check.
     # The configuration is done in app.py and GenAI calls will fail if not configured.
     # You can add a check for the API key environment variable if desired for an earlier warning.
@@ -50,11 +114,11 @@ def get_refined_search_gemini(image_description, user_prompt, product_context_st
         return {"error": "Gemini API key not configured in environment."}
 
     try:
-        gemini_model_name = "gemini-1.5-flash-latest" # Or "gemini-1.5-pro-latest"
+        import google.generativeai as genai
         # Ensure genai.configure() was called in app.py before this point.
         # The SDK should use the globally configured API key.
-        model = genai.GenerativeModel(gemini_model_name)
-        current_app.logger.info(f"Using Gemini model for refinement: {gemini_model_name}")
+        model = genai.GenerativeModel(GEMINI_MODEL_NAME)
+        current_app.logger.info(f"Using Gemini model for refinement: {GEMINI_MODEL_NAME}")
         
         prompt_template = f"""
         You are an AI shopping assistant helping a user find products based on an image and a text query.
@@ -0,0 +1,105 @@
+# backend_flask/ai_core/pipeline.py
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from flask import current_app
+
+PIPELINE_WORKERS = int(os.getenv("PIPELINE_WORKERS", "16"))
+
+# Shared by all requests in this process. Stages never block on each other inside the pool:
+# the calling thread submits a stage only once its dependencies have finished.
+_executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="rec-pipeline")
+
+_stage_stats = {} # stage name -> {"runs", "total_ms", "max_ms"}
+_stage_stats_lock = threading.Lock()
+
+def _reset_executor_after_fork():
+    # Worker threads do not survive fork(); a server that preloads the app (and built the homepage
+    # through a StageGraph) would hand its workers an executor whose threads are gone.
+    global _executor, _stage_stats_lock
+    _executor = ThreadPoolExecutor(max_workers=PIPELINE_WORKERS, thread_name_prefix="rec-pipeline")
+    _stage_stats_lock = threading.Lock()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_executor_after_fork)
+
+def _record_stage_time(name, elapsed_ms):
+    with _stage_stats_lock:
+        stats = _stage_stats.setdefault(name, {"runs": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stats["runs"] += 1
+        stats["total_ms"] += elapsed_ms
+        stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+
+def get_pipeline_stats():
+    with _stage_stats_lock:
+        return {name: {**s, "avg_ms": s["total_ms"] / s["runs"] if s["runs"] else 0.0} for name, s in _stage_stats.items()}
+
+
+class StageGraph:
+    """
+    A small dependency graph of pipeline stages run on the shared executor.
+
+        graph = StageGraph("upload")
+        graph.add("vision", describe_image)
+        graph.add("embedding", embed_image)
+        graph.add("refine", refine, deps=("vision", "embedding")) # refine(vision_result, embedding_result)
+        results = graph.run()
+
+    Independent stages overlap; a stage starts as soon as all of its dependencies are done.
+    Each stage runs inside the caller's app context and its wall time is recorded in `timings`.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.stages = {} # name -> (fn, deps)
+        self.timings = {} # stage name -> elapsed ms
+
+    def add(self, name, fn, deps=()):
+        for dep in deps:
+            if dep not in self.stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        self.stages[name] = (fn, tuple(deps))
+        return self
+
+    def _run_stage(self, app, name, fn, args):
+        start = time.perf_counter()
+        try:
+            with app.app_context():
+                return fn(*args)
+        finally:
+            elapsed_ms = 1000.0 * (time.perf_counter() - start)
+            self.timings[name] = elapsed_ms
+            _record_stage_time(name, elapsed_ms)
+
+    def run(self):
+        """Runs every stage and returns {stage name: result}. Re-raises the first stage exception."""
+        return dict(self.iter_results())
+
+    def iter_results(self):
+        """
+        Runs every stage, yielding (stage name, result) as each one finishes, so callers can
+        stream partial results. Re-raises the first stage exception.
+        """
+        app = current_app._get_current_object()
+        start = time.perf_counter()
+        results, running = {}, {}
+        pending = dict(self.stages)
+        while pending or running:
+            for name, (fn, deps) in list(pending.items()):
+                if all(dep in results for dep in deps):
+                    args = [results[dep] for dep in deps]
+                    running[_executor.submit(self._run_stage, app, name, fn, args)] = name
+                    del pending[name]
+            if not running: # Only possible if the remaining stages can never become ready
+                raise RuntimeError(f"Unsatisfiable stage dependencies in '{self.name}': {list(pending)}")
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+                yield name, results[name]
+
+        total_ms = 1000.0 * (time.perf_counter() - start)
+        _record_stage_time(f"{self.name}.total", total_ms)
+        stage_summary = ", ".join(f"{name}={ms:.0f}ms" for name, ms in self.timings.items())
+        current_app.logger.info(f"Pipeline '{self.name}' finished in {total_ms:.0f}ms ({stage_summary})")
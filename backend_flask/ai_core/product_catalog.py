@@ -1,25 +1,134 @@
 # backend_flask/ai_core/product_catalog.py
+import copy
+import hashlib
 import json
 import os
+import sys
+import threading
+import time
+import numpy as np
 from flask import current_app
-from .vision_models import extract_vit_features # For ViT embeddings
+from .vision_models import extract_vit_features_batch, VIT_EMBEDDING_SPACE # For ViT embeddings
+from .language_models import extract_keywords_spacy_batch
+from .embedding_cache import load_embedding_cache, save_embedding_cache, image_fingerprint, share_catalog_matrix
+from .vector_index import FlatIndex, OverlayIndex, load_index
+from .text_index import KeywordIndex, product_text
+from .catalog_features import CatalogFeatures
+from .catalog_store import CatalogStore
 
 DB_METADATA_FILE = "curated_product_catalog.json"
 DB_IMAGE_FOLDER_RELATIVE = os.path.join("static", "product_images_db") # Relative to backend_flask
-AI_PRODUCT_CATALOG = [] # This will hold products with embeddings
+
+# Vector index selection. "flat" is exact; "ivf"/"hnsw" must be built offline with build_vector_index.py
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "flat").lower()
+VECTOR_INDEX_DIR_RELATIVE = "vector_index" # Relative to backend_flask
+IVF_NPROBE = os.getenv("IVF_NPROBE") # Optional query-time overrides of the saved index settings
+HNSW_EF_SEARCH = os.getenv("HNSW_EF_SEARCH")
+
+
+class CatalogSnapshot:
+    """
+    One version of the loaded catalog: the columnar product store, the normalized embedding matrix and
+    every index built over them. A snapshot is never modified once published. Reloads build a new one
+    to the side and swap CATALOG_SNAPSHOT in a single assignment, so a request that took a snapshot sees
+    positions, matrix rows and indexes that agree with each other until it finishes.
+    """
+
+    __slots__ = ("version", "loaded_at", "store", "embedding_matrix", "embedding_ids", "embedding_positions",
+                 "embedding_matrix_path", "vector_index", "base_vector_index", "base_vector_index_stamp", "embedded_at",
+                 "stale_embedding_ids", "features", "text_index",
+                 "record_hashes", "image_sha1s", "product_keywords")
+
+    def __init__(self):
+        self.version = 0
+        self.loaded_at = None
+        self.store = CatalogStore() # Columnar product records; store[position] materializes a product dict
+        self.embedding_matrix = None # (N, dim) contiguous float32, rows L2-normalized once at load time; the only copy of the embeddings
+        self.embedding_ids = None # (N,) product ids, parallel to the matrix rows
+        self.embedding_positions = None # (N,) index into store for each matrix row
+        self.embedding_matrix_path = None # Directory the three arrays above are memory-mapped from; None when held in process memory
+        self.vector_index = None # Index answering visual similarity queries over the matrix rows
+        self.base_vector_index = None # Offline ivf/hnsw index as loaded from disk (unattached), reused across reloads
+        self.base_vector_index_stamp = None # Files of the offline index when loaded; a reload re-reads it once they change
+        self.embedded_at = {} # product id -> time this process (re-)embedded it
+        self.stale_embedding_ids = frozenset() # Products embedded after the offline index was built, so it lacks their vectors
+        self.features = None # Integer-coded attribute columns for vectorized scoring; rows are store positions
+        self.text_index = None # BM25 inverted index over product text; documents are store positions
+        self.record_hashes = {} # product id -> hash of its JSON record, for diffing reloads
+        self.image_sha1s = {} # product id -> SHA-1 of the image it was embedded from
+        self.product_keywords = {} # product id -> spaCy keyword lemmas of its text, indexed alongside the raw tokens
+
+    def search_similar(self, query_embedding, top_k=10):
+        """
+        Returns up to top_k (product, cosine_similarity) pairs, most similar first.
+        The query is normalized once and handed to the configured vector index (exact flat by default).
+        """
+        if self.vector_index is None or query_embedding is None or top_k <= 0:
+            return []
+        query = _l2_normalize(np.asarray(query_embedding, dtype=np.float32).reshape(-1))
+        rows, similarities = self.vector_index.search(query, top_k)
+        return [(self.store[self.embedding_positions[row]], float(score)) for row, score in zip(rows, similarities)]
+
+    def score_keywords(self, keywords):
+        """BM25 scores of every catalog position at once (a text_index.KeywordScores), or None without an index."""
+        if self.text_index is None:
+            return None
+        return self.text_index.score(keywords or [])
+
+    def positions_of(self, product_ids):
+        """Catalog positions for product ids as an int array (-1 for unknown ids)."""
+        positions_by_id = self.store.positions_by_id
+        return np.array([positions_by_id.get(str(pid), -1) for pid in product_ids], dtype=np.int64)
+
+    def preference_scores(self, product_ids, user_preferences):
+        """Preference boost (CatalogFeatures weights) for each product id as an array; 0 for ids not in this snapshot."""
+        scores = np.zeros(len(product_ids), dtype=np.float64)
+        if self.features is None or not user_preferences or not len(product_ids):
+            return scores
+        positions = self.positions_of(product_ids)
+        known = positions >= 0
+        scores[known] = self.features.preference_scores(user_preferences)[positions[known]]
+        return scores
+
+    def describe(self):
+        return {
+            "version": self.version, "loaded_at": self.loaded_at, "products": len(self.store),
+            "embedded_products": 0 if self.embedding_ids is None else int(len(self.embedding_ids)),
+            "embedding_matrix_file": self.embedding_matrix_path,
+            "vector_index": self.vector_index.describe() if self.vector_index is not None else None,
+        }
+
+
+CATALOG_SNAPSHOT = CatalogSnapshot() # Rebound (never mutated) by load_and_preprocess_catalog()
+_reload_lock = threading.Lock() # One catalog build at a time; readers never take it
+
+def get_catalog_file_path():
+    return os.path.join(current_app.root_path, DB_METADATA_FILE)
+
+def _record_hash(product_data):
+    return hashlib.sha1(json.dumps(product_data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
 
 def load_and_preprocess_catalog():
     """
-    Loads product data from a JSON file and computes ViT embeddings for their local images.
-    This should be called once on app startup.
+    Loads product data from the JSON file, computes ViT embeddings for their local images, and publishes
+    the result as a new CatalogSnapshot. Called once on app startup and again for every hot reload.
+    Embeddings are reused from the on-disk cache (see embedding_cache.py); only products whose
+    image bytes or ViT model changed are re-embedded. The current snapshot keeps serving requests while
+    the new one is built, and stays in place if the file cannot be read or nothing changed.
+    Returns a summary of the diff against the previous snapshot (with an "error" key on failure).
     """
-    global AI_PRODUCT_CATALOG
-    AI_PRODUCT_CATALOG = [] # Reset
+    with _reload_lock:
+        return _load_catalog_snapshot()
+
+def _load_catalog_snapshot():
+    global CATALOG_SNAPSHOT
+    start = time.perf_counter()
+    previous = CATALOG_SNAPSHOT
     
     # ViT model must be loaded first (done in app.py's app_context)
     # We'll assume extract_vit_features will work if models are loaded.
 
-    catalog_file_path = os.path.join(current_app.root_path, DB_METADATA_FILE)
+    catalog_file_path = get_catalog_file_path()
     current_app.logger.info(f"Attempting to load product catalog from: {catalog_file_path}")
 
     try:
@@ -28,14 +137,23 @@ def load_and_preprocess_catalog():
         current_app.logger.info(f"Loaded {len(raw_products)} raw products from {DB_METADATA_FILE}")
     except FileNotFoundError:
         current_app.logger.error(f"{DB_METADATA_FILE} not found. Cannot populate product catalog.")
-        return
+        return {"error": f"{DB_METADATA_FILE} not found.", "version": previous.version}
     except json.JSONDecodeError:
         current_app.logger.error(f"Error decoding JSON from {DB_METADATA_FILE}.")
-        return
+        return {"error": f"Error decoding JSON from {DB_METADATA_FILE}.", "version": previous.version}
 
+    cached_entries, cached_matrix = load_embedding_cache(VIT_EMBEDDING_SPACE)
+    cache_records = {} # product id -> record to persist in the embedding cache
+    products = [] # Product dicts, only kept until the columnar store and indexes are built
+    embeddings = [] # Parallel to products: raw ViT embedding or None
+    pending_embeddings = [] # (position, product, abs_image_path, fingerprint) for cache misses
+    record_hashes, image_sha1s = {}, {}
+    cache_hits = 0
     processed_count = 0
     for product_data in raw_products:
         product = product_data.copy() # Work with a copy
+        product_id = str(product.get('id'))
+        record_hashes[product_id] = _record_hash(product_data)
         
         # Image path for ViT embedding (relative to backend_flask)
         # Assumes 'image_path_for_ai' in JSON is like "static/product_images_db/image.jpg"
@@ -46,15 +164,20 @@ def load_and_preprocess_catalog():
             abs_image_path_for_ai = os.path.join(current_app.root_path, rel_image_path)
         
         if abs_image_path_for_ai and os.path.exists(abs_image_path_for_ai):
-            embedding = extract_vit_features(abs_image_path_for_ai)
-            if embedding is not None:
-                product["embedding"] = embedding
+            cached_entry = cached_entries.get(product_id)
+            sha1, size, mtime_ns = image_fingerprint(abs_image_path_for_ai, cached_entry)
+            image_sha1s[product_id] = sha1
+            if cached_entry and cached_matrix is not None and cached_entry.get("sha1") == sha1:
+                embedding = cached_matrix[cached_entry["row"]] # Read-only view into the memmap
+                embeddings.append(embedding)
+                cache_records[product_id] = {"embedding": embedding, "sha1": sha1, "size": size, "mtime_ns": mtime_ns}
+                cache_hits += 1
                 processed_count += 1
             else:
-                product["embedding"] = None
-                current_app.logger.warning(f"Failed to get ViT embedding for {product.get('name', 'Unknown Product')} (Path: {abs_image_path_for_ai})")
+                embeddings.append(None) # Filled in by the batched pass below
+                pending_embeddings.append((len(products), product, abs_image_path_for_ai, {"sha1": sha1, "size": size, "mtime_ns": mtime_ns}))
         else:
-            product["embedding"] = None
+            embeddings.append(None)
             current_app.logger.warning(f"Image for ViT not found or path missing for {product.get('name', 'Unknown Product')}. Path checked: {abs_image_path_for_ai}")
 
         # Ensure 'images' (for frontend) uses a web-accessible path
@@ -68,14 +191,223 @@ def load_and_preprocess_catalog():
         else:
             product["imageUrl"] = "/static/placeholder_no_image.png" # Fallback
 
-        AI_PRODUCT_CATALOG.append(product)
+        product.pop("embedding", None) # Placeholder field from prepare_dataset.py; embeddings are kept separately
+        products.append(product)
+
+    # Diff against the catalog being served. Unchanged products never reach the ViT model: their
+    # embeddings come straight from the cache, so only the diff is embedded below.
+    added = record_hashes.keys() - previous.record_hashes.keys()
+    removed = previous.record_hashes.keys() - record_hashes.keys()
+    changed = {pid for pid in record_hashes.keys() & previous.record_hashes.keys()
+               if record_hashes[pid] != previous.record_hashes[pid] or image_sha1s.get(pid) != previous.image_sha1s.get(pid)}
+    summary = {"added": len(added), "removed": len(removed), "changed": len(changed), "products": len(products)}
+    index_stamp = vector_index_stamp()
+    index_changed = bool(previous.version) and index_stamp != previous.base_vector_index_stamp
+    if index_changed:
+        summary["vector_index_reloaded"] = True
+    if previous.version and not (added or removed or changed or pending_embeddings or index_changed):
+        current_app.logger.info(f"Catalog unchanged; keeping version {previous.version}.")
+        return {**summary, "version": previous.version, "swapped": False, "embedded": 0}
     
-    current_app.logger.info(f"Finished catalog preprocessing. {processed_count}/{len(AI_PRODUCT_CATALOG)} products have ViT embeddings.")
-    if processed_count == 0 and len(AI_PRODUCT_CATALOG) > 0:
+    embedded_ids = set()
+    if pending_embeddings:
+        current_app.logger.info(f"Computing ViT embeddings for {len(pending_embeddings)} products in batches...")
+        new_embeddings = extract_vit_features_batch([path for _, _, path, _ in pending_embeddings])
+        for (position, product, abs_image_path_for_ai, fingerprint), embedding in zip(pending_embeddings, new_embeddings):
+            if embedding is not None:
+                embeddings[position] = embedding
+                cache_records[str(product.get('id'))] = {"embedding": embedding, **fingerprint}
+                embedded_ids.add(str(product.get('id')))
+                processed_count += 1
+            else:
+                current_app.logger.warning(f"Failed to get ViT embedding for {product.get('name', 'Unknown Product')} (Path: {abs_image_path_for_ai})")
+
+    # Rewrite the cache only if something was re-embedded, moved, or dropped from the catalog
+    cache_is_stale = (cache_hits != len(cache_records) or set(cached_entries) != set(cache_records)
+                      or any(cached_entries[pid].get("mtime_ns") != rec["mtime_ns"] for pid, rec in cache_records.items()))
+    if cache_is_stale:
+        save_embedding_cache(VIT_EMBEDDING_SPACE, cache_records)
+
+    snapshot = CatalogSnapshot()
+    snapshot.version = previous.version + 1
+    snapshot.loaded_at = time.time()
+    snapshot.store = CatalogStore(products)
+    snapshot.record_hashes = record_hashes
+    snapshot.image_sha1s = image_sha1s
+    if previous.version and not index_changed:
+        snapshot.base_vector_index = previous.base_vector_index
+    else:
+        if index_changed:
+            current_app.logger.info(f"Offline {VECTOR_INDEX_TYPE} index changed on disk (rebuilt with build_vector_index.py); reloading it.")
+        snapshot.base_vector_index = load_vector_index()
+    snapshot.base_vector_index_stamp = index_stamp
+    embedded_now = time.time()
+    snapshot.embedded_at = {pid: t for pid, t in previous.embedded_at.items() if pid in record_hashes}
+    snapshot.embedded_at.update(dict.fromkeys(embedded_ids, embedded_now))
+    index_built_at = max((mtime_ns for _, _, mtime_ns in index_stamp), default=0) / 1e9 if index_stamp else 0.0
+    snapshot.stale_embedding_ids = frozenset(pid for pid, t in snapshot.embedded_at.items() if t > index_built_at)
+    build_embedding_matrix(snapshot, embeddings)
+    snapshot.features = CatalogFeatures(products)
+    snapshot.product_keywords = precompute_product_keywords(products, record_hashes, previous)
+    snapshot.text_index = KeywordIndex(products, [snapshot.product_keywords[str(p.get('id'))] for p in products])
+    CATALOG_SNAPSHOT = snapshot # Publish: requests that start from here on see the new catalog
+
+    elapsed_ms = 1000.0 * (time.perf_counter() - start)
+    current_app.logger.info(f"Built keyword index: {len(snapshot.text_index.vocabulary)} terms over {snapshot.text_index.num_docs} products.")
+    current_app.logger.info(f"Embedding cache: {cache_hits} hits, {len(cache_records) - cache_hits} products (re-)embedded.")
+    current_app.logger.info(f"Catalog version {snapshot.version} published in {elapsed_ms:.0f}ms: {len(added)} added, "
+                            f"{len(removed)} removed, {len(changed)} changed. {processed_count}/{len(snapshot.store)} products have ViT embeddings.")
+    if processed_count == 0 and len(snapshot.store) > 0:
         current_app.logger.warning("No products were successfully embedded with ViT. Check image paths and ViT model loading.")
+    return {**summary, "version": snapshot.version, "swapped": True, "embedded": len(embedded_ids), "elapsed_ms": round(elapsed_ms, 1)}
+
+def precompute_product_keywords(products, record_hashes, previous):
+    """
+    spaCy keyword lemmas for every product (see language_models.extract_keywords_spacy_batch), so catalog
+    text is matched in the same lemma space as query keywords without parsing anything per request.
+    Products whose JSON record is unchanged since `previous` reuse its lemmas; the rest go through nlp.pipe.
+    """
+    product_keywords, pending = {}, []
+    for product in products:
+        product_id = str(product.get('id'))
+        if product_id in previous.product_keywords and previous.record_hashes.get(product_id) == record_hashes[product_id]:
+            product_keywords[product_id] = previous.product_keywords[product_id]
+        else:
+            pending.append((product_id, product))
+    if pending:
+        keyword_lists = extract_keywords_spacy_batch([product_text(product) for _, product in pending])
+        for (product_id, _), keywords in zip(pending, keyword_lists):
+            product_keywords[product_id] = tuple(sys.intern(k) for k in keywords)
+        current_app.logger.info(f"Lemmatized keywords for {len(pending)} products ({len(products) - len(pending)} reused).")
+    return product_keywords
+
+def _l2_normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0 # Zero vectors stay zero (cosine similarity 0), like sklearn
+    return vectors / norms
+
+def build_embedding_matrix(snapshot, embeddings):
+    """
+    Packs the product embeddings (a list parallel to snapshot.store, None where missing) into one
+    contiguous, L2-normalized float32 matrix plus parallel id/position arrays, so visual search is a
+    single matrix-vector product, and attaches the vector index to it.
+    The arrays are then swapped for read-only memmaps shared by all worker processes (share_catalog_matrix).
+    """
+    positions = [i for i, embedding in enumerate(embeddings) if embedding is not None]
+    if not positions:
+        return
+    matrix = np.vstack([np.asarray(embeddings[i], dtype=np.float32) for i in positions])
+    (snapshot.embedding_matrix, snapshot.embedding_ids, snapshot.embedding_positions,
+     snapshot.embedding_matrix_path) = share_catalog_matrix(_l2_normalize(matrix),
+                                                             np.array([snapshot.store.ids[i] for i in positions]),
+                                                             np.array(positions, dtype=np.int64))
+    current_app.logger.info(f"Built normalized embedding matrix: {snapshot.embedding_matrix.shape} "
+                            f"({snapshot.embedding_matrix_path or 'in process memory'})")
+    snapshot.vector_index = attach_vector_index(snapshot.base_vector_index, snapshot.embedding_matrix,
+                                                snapshot.embedding_ids, snapshot.stale_embedding_ids)
+
+def get_vector_index_dir():
+    return os.path.join(current_app.root_path, VECTOR_INDEX_DIR_RELATIVE, VECTOR_INDEX_TYPE)
+
+def vector_index_stamp():
+    """(name, size, mtime_ns) of every file of the configured offline index, or None for "flat" or no index."""
+    if VECTOR_INDEX_TYPE == "flat":
+        return None
+    index_dir = get_vector_index_dir()
+    try:
+        return tuple(sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns)
+                            for entry in os.scandir(index_dir) if entry.is_file() and entry.name != "recall_report.json"))
+    except OSError:
+        return None
+
+def load_vector_index():
+    """
+    Loads the configured offline vector index from disk, or returns None if it is missing, unusable,
+    or set to "flat". The index is attached to a catalog matrix separately (attach_vector_index).
+    """
+    if VECTOR_INDEX_TYPE == "flat":
+        return None
+    index_dir = get_vector_index_dir()
+    try:
+        index = load_index(index_dir)
+        if IVF_NPROBE and index.kind == "ivf":
+            index.nprobe = int(IVF_NPROBE)
+        if HNSW_EF_SEARCH and index.kind == "hnsw":
+            index.set_ef_search(int(HNSW_EF_SEARCH))
+        current_app.logger.info(f"Loaded vector index: {index.describe()}")
+        return index
+    except FileNotFoundError:
+        current_app.logger.warning(f"VECTOR_INDEX_TYPE={VECTOR_INDEX_TYPE} but no index found at {index_dir}. "
+                                   "Build it with build_vector_index.py. Using flat search.")
+    except (ImportError, ValueError, OSError, KeyError) as e:
+        current_app.logger.error(f"Could not load vector index from {index_dir}: {e}. Using flat search.")
+    return None
+
+def attach_vector_index(base_index, matrix, ids, stale_ids=frozenset()):
+    """
+    Returns the index a snapshot searches with. The offline index is attached through a shallow copy,
+    so snapshots still serving requests keep their own row mapping. Products the offline index does not
+    cover, or holds an outdated vector for (`stale_ids`), are searched exactly through an OverlayIndex.
+    Falls back to exact flat search without a usable offline index.
+    """
+    if base_index is not None:
+        index = copy.copy(base_index)
+        if index.attach(matrix, ids):
+            covered = np.zeros(matrix.shape[0], dtype=bool)
+            covered[index.covered_rows()] = True
+            stale = np.isin(ids, list(stale_ids)) if stale_ids else np.zeros(matrix.shape[0], dtype=bool)
+            delta_rows = np.flatnonzero(~covered | stale)
+            if not len(delta_rows):
+                return index
+            current_app.logger.info(f"{len(delta_rows)} products are newer than the vector index and are searched exactly. "
+                                    "Rebuild it with build_vector_index.py to fold them in.")
+            return OverlayIndex(index, matrix, delta_rows, shadowed_count=int((covered & stale).sum()))
+        current_app.logger.warning("Vector index shares no products with the catalog. Using flat search.")
+    index = FlatIndex()
+    index.attach(matrix, ids)
+    return index
+
+def get_catalog_snapshot():
+    """The catalog version currently being served. Take it once per request and read everything from it."""
+    return CATALOG_SNAPSHOT
+
+def search_similar_products(query_embedding, top_k=10):
+    return CATALOG_SNAPSHOT.search_similar(query_embedding, top_k)
+
+def search_products_by_keywords(keywords):
+    """
+    Looks keywords up in the inverted index.
+    Returns {product id: (product, bm25_score, [matched keywords])} for matching products only.
+    """
+    snapshot = CATALOG_SNAPSHOT
+    if snapshot.text_index is None or not keywords:
+        return {}
+    return {snapshot.store.ids[doc]: (snapshot.store[doc], score, matched)
+            for doc, (score, matched) in snapshot.text_index.search(keywords).items()}
+
+def score_catalog_by_keywords(keywords):
+    return CATALOG_SNAPSHOT.score_keywords(keywords)
+
+def get_catalog_features():
+    return CATALOG_SNAPSHOT.features
+
+def get_catalog_positions(product_ids):
+    return CATALOG_SNAPSHOT.positions_of(product_ids)
 
 def get_catalog_products():
-    """Returns the processed product catalog."""
-    return AI_PRODUCT_CATALOG
+    """Returns the processed product catalog (a CatalogStore: len(), and catalog[position] -> product dict)."""
+    return CATALOG_SNAPSHOT.store
+
+def get_product_by_id(product_id):
+    """Returns a dict view of the catalog product with this id (int or str), or None."""
+    catalog = CATALOG_SNAPSHOT.store
+    position = catalog.position_of(product_id)
+    return catalog[position] if position is not None else None
+
+def get_products_by_ids(product_ids):
+    """Bulk lookup. Returns a list of product dict views aligned with product_ids, with None for unknown ids."""
+    catalog = CATALOG_SNAPSHOT.store
+    positions = [catalog.position_of(pid) for pid in product_ids]
+    return [catalog[position] if position is not None else None for position in positions]
 
-# You can add search functions here later, e.g., search_by_keywords, get_similar_by_embedding
\ No newline at end of file
+# You can add search functions here later, e.g., search_by_keywords, get_similar_by_embedding
@@ -0,0 +1,162 @@
+# backend_flask/ai_core/text_index.py
+import bisect
+import re
+from collections import Counter, defaultdict
+import numpy as np
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+INDEXED_TEXT_FIELDS = ("name", "description", "type", "category", "style", "material")
+BM25_K1 = 1.2
+BM25_B = 0.75
+MIN_PREFIX_LENGTH = 3 # Shorter tokens ("a", "in") only match exactly
+MAX_CACHED_EXPANSIONS = 10_000
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower()) if text else []
+
+def product_text(product):
+    """The product's indexed text fields joined into one string (e.g. for lemmatizing with spaCy)."""
+    return " ".join(str(product.get(field, "") or "") for field in INDEXED_TEXT_FIELDS)
+
+def product_tokens(product, extra_terms=()):
+    """
+    Tokens for one product across the indexed text fields and its color tags, plus any `extra_terms`
+    (e.g. spaCy lemmas of its text) that the text does not already contain.
+    """
+    tokens = []
+    for field in INDEXED_TEXT_FIELDS:
+        tokens.extend(tokenize(str(product.get(field, "") or "")))
+    for tag in product.get("color_tags", []) or []:
+        tokens.extend(tokenize(tag))
+    if extra_terms:
+        seen = set(tokens)
+        for term in extra_terms:
+            for token in tokenize(term):
+                if token not in seen:
+                    seen.add(token)
+                    tokens.append(token)
+    return tokens
+
+
+class KeywordScores:
+    """
+    BM25 results for one query over the whole catalog: a dense (N,) score vector plus,
+    per keyword, the sorted array of matching documents (used to explain only the returned results).
+    """
+
+    def __init__(self, scores, docs_by_keyword):
+        self.scores = scores
+        self.docs_by_keyword = docs_by_keyword # keyword -> sorted int array of docs it matched
+
+    def matched_docs(self):
+        """Sorted array of documents matching at least one keyword."""
+        if not self.docs_by_keyword:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(list(self.docs_by_keyword.values())))
+
+    def matched_keywords(self, doc):
+        matched = []
+        for keyword, docs in self.docs_by_keyword.items():
+            position = np.searchsorted(docs, doc)
+            if position < len(docs) and docs[position] == doc:
+                matched.append(keyword)
+        return matched
+
+
+class KeywordIndex:
+    """
+    Inverted index over catalog text with BM25 scoring.
+    Documents are positions in the product list the index was built from.
+    Postings are NumPy arrays, so a keyword is scored against all of its documents in one vector operation.
+
+    Keyword tokens of 3+ characters are prefix-expanded against the vocabulary ("shirt" also hits "shirts"),
+    which approximates the substring matching the scorer used before without scanning products.
+    A multi-word keyword ("red floral dress") matches a product only if every word does.
+
+    `extra_terms`, if given, is parallel to `products`: additional terms per product such as the spaCy
+    lemmas of its text, so lemmatized query keywords ("woman") hit inflected catalog text ("Women").
+    """
+
+    def __init__(self, products, extra_terms=None):
+        postings = defaultdict(dict) # term -> {doc: term frequency}
+        doc_lengths = []
+        for doc, product in enumerate(products):
+            tokens = product_tokens(product, extra_terms[doc] if extra_terms else ())
+            doc_lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                postings[term][doc] = tf
+        # term -> (sorted doc array, parallel term frequency array)
+        self.postings = {term: (np.fromiter(docs, dtype=np.int64, count=len(docs)),
+                                np.fromiter(docs.values(), dtype=np.float64, count=len(docs)))
+                         for term, docs in postings.items()}
+        self.doc_lengths = np.array(doc_lengths, dtype=np.float64)
+        self.num_docs = len(doc_lengths)
+        self.avg_doc_length = float(self.doc_lengths.mean()) if self.num_docs else 0.0
+        self.avg_doc_length = self.avg_doc_length or 1.0 # Avoid dividing by zero when every product is empty
+        self.length_norms = BM25_K1 * (1.0 - BM25_B + BM25_B * self.doc_lengths / self.avg_doc_length)
+        self.vocabulary = sorted(self.postings)
+        self._expansions = {} # token -> merged postings for all vocabulary terms with that prefix
+
+    _EMPTY_POSTINGS = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float64))
+
+    def _expanded_postings(self, token):
+        cached = self._expansions.get(token)
+        if cached is not None:
+            return cached
+        if len(token) < MIN_PREFIX_LENGTH:
+            return self.postings.get(token, self._EMPTY_POSTINGS)
+        matches = []
+        position = bisect.bisect_left(self.vocabulary, token)
+        while position < len(self.vocabulary) and self.vocabulary[position].startswith(token):
+            matches.append(self.postings[self.vocabulary[position]])
+            position += 1
+        if not matches:
+            merged = self._EMPTY_POSTINGS
+        elif len(matches) == 1:
+            merged = matches[0]
+        else: # Sum term frequencies of every expansion per document
+            docs, inverse = np.unique(np.concatenate([m[0] for m in matches]), return_inverse=True)
+            merged = (docs, np.bincount(inverse, weights=np.concatenate([m[1] for m in matches])))
+        if len(self._expansions) >= MAX_CACHED_EXPANSIONS:
+            self._expansions = {}
+        self._expansions[token] = merged
+        return merged
+
+    def _idf(self, doc_freq):
+        return np.log(1.0 + (self.num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def score(self, keywords):
+        """Scores every product against the keywords at once. Returns a KeywordScores."""
+        scores = np.zeros(self.num_docs, dtype=np.float64)
+        docs_by_keyword = {}
+        for keyword in keywords:
+            tokens = [token for token in tokenize(keyword) if len(token) > 1] # Single letters carry no signal
+            if not tokens or keyword in docs_by_keyword:
+                continue
+            token_postings = [self._expanded_postings(token) for token in tokens]
+            if any(not len(docs) for docs, _ in token_postings):
+                continue
+            token_postings.sort(key=lambda p: len(p[0])) # Intersect starting from the rarest token
+            matching_docs = token_postings[0][0]
+            for docs, _ in token_postings[1:]:
+                matching_docs = np.intersect1d(matching_docs, docs, assume_unique=True)
+            if not len(matching_docs):
+                continue
+            length_norms = self.length_norms[matching_docs]
+            keyword_scores = np.zeros(len(matching_docs), dtype=np.float64)
+            for docs, tfs in token_postings:
+                tf = tfs[np.searchsorted(docs, matching_docs)]
+                keyword_scores += self._idf(len(docs)) * tf * (BM25_K1 + 1.0) / (tf + length_norms)
+            scores[matching_docs] += keyword_scores
+            docs_by_keyword[keyword] = matching_docs
+        return KeywordScores(scores, docs_by_keyword)
+
+    def search(self, keywords):
+        """
+        Scores every product matching at least one keyword.
+        Returns {doc: (bm25_score, [matched keywords])}; products that match nothing are absent.
+        """
+        if not self.num_docs:
+            return {}
+        result = self.score(keywords)
+        return {int(doc): (float(result.scores[doc]), result.matched_keywords(doc)) for doc in result.matched_docs()}
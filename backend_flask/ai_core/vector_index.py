@@ -0,0 +1,309 @@
+# backend_flask/ai_core/vector_index.py
+"""
+Pluggable vector indexes for visual similarity search.
+
+All indexes work on L2-normalized float32 vectors, so inner product == cosine similarity.
+Indexes are keyed by product id rather than by row, which lets an index built offline be
+attached to whatever catalog matrix the app loaded at startup (see `attach`).
+
+    flat  - exact brute force over the catalog matrix (default, nothing to build)
+    ivf   - inverted file: k-means coarse quantizer, probes `nprobe` lists (pure NumPy)
+    hnsw  - hierarchical navigable small world graph via the optional `hnswlib` package
+
+An OverlayIndex wraps an ivf/hnsw index with an exact scan over products added or re-embedded
+after it was built, so catalog reloads never need an index rebuild to stay searchable.
+"""
+import json
+import os
+import time
+import numpy as np
+
+try:
+    import hnswlib # Optional: only needed for the "hnsw" index type
+except ImportError:
+    hnswlib = None
+
+INDEX_META_FILE = "index_meta.json"
+INDEX_IDS_FILE = "ids.npy"
+
+def _top_k(scores, k):
+    """Returns positions of the k largest scores, best first."""
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class FlatIndex:
+    """Exact search: one matrix-vector product over every catalog row."""
+    kind = "flat"
+
+    def __init__(self, ids=None):
+        self.ids = ids
+        self._matrix = None
+
+    def attach(self, matrix, ids):
+        self._matrix = matrix
+        self.ids = ids
+        return True
+
+    def search(self, query, k):
+        """`query` must be L2-normalized. Returns (catalog_rows, scores), best first."""
+        if self._matrix is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self._matrix @ query
+        rows = _top_k(scores, k)
+        return rows, scores[rows]
+
+    def save(self, directory):
+        pass # Nothing to persist; rebuilt from the catalog matrix
+
+    def describe(self):
+        return {"kind": self.kind}
+
+
+class _IdMappedIndex:
+    """Shared logic for indexes that were built offline over a list of product ids."""
+
+    def __init__(self, ids):
+        self.ids = np.asarray(ids)
+        self._rows = None # index position -> catalog matrix row (-1 if the product is gone)
+        self._matrix = None
+
+    def attach(self, matrix, ids):
+        row_for_id = {pid: row for row, pid in enumerate(ids.tolist())}
+        self._rows = np.array([row_for_id.get(pid, -1) for pid in self.ids.tolist()], dtype=np.int64)
+        self._matrix = matrix
+        covered = int((self._rows >= 0).sum())
+        self.coverage = covered / max(1, len(ids))
+        return covered > 0
+
+    def covered_rows(self):
+        """Catalog matrix rows this index can return (once attached)."""
+        return self._rows[self._rows >= 0]
+
+    def _write_meta(self, directory, **meta):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, INDEX_IDS_FILE), self.ids)
+        with open(os.path.join(directory, INDEX_META_FILE), "w") as f:
+            json.dump({"kind": self.kind, "count": int(len(self.ids)), **meta}, f)
+
+
+class IVFIndex(_IdMappedIndex):
+    """
+    Inverted-file index. Vectors are bucketed by nearest k-means centroid; a query scans only
+    the `nprobe` closest buckets and re-scores those candidates exactly against the catalog matrix.
+    Larger nprobe -> higher recall, higher latency.
+    """
+    kind = "ivf"
+
+    def __init__(self, ids, centroids, list_offsets, list_members, nprobe=8):
+        super().__init__(ids)
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.list_offsets = list_offsets
+        self.list_members = list_members
+        self.nprobe = nprobe
+
+    @classmethod
+    def build(cls, vectors, ids, nlist=None, nprobe=8, train_size=100_000, iterations=15, seed=0):
+        n = vectors.shape[0]
+        nlist = max(1, min(nlist or int(4 * np.sqrt(n)), n))
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(n, size=min(n, max(train_size, nlist)), replace=False)]
+
+        # Spherical k-means on a sample
+        centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = cls._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.bincount(assignment, minlength=nlist) == 0
+            sums[empty] = sample[rng.choice(sample.shape[0], size=int(empty.sum()))] # Re-seed empty lists
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = (sums / norms).astype(np.float32)
+
+        assignment = cls._assign(vectors, centroids)
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=nlist)
+        list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        return cls(ids, centroids, list_offsets, order.astype(np.int64), nprobe=nprobe)
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk_size=65_536):
+        assignment = np.empty(vectors.shape[0], dtype=np.int64)
+        for start in range(0, vectors.shape[0], chunk_size):
+            assignment[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+        return assignment
+
+    def search(self, query, k):
+        if self._matrix is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        probe_lists = _top_k(self.centroids @ query, self.nprobe)
+        members = np.concatenate([self.list_members[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probe_lists])
+        rows = self._rows[members]
+        rows = rows[rows >= 0]
+        scores = self._matrix[rows] @ query
+        best = _top_k(scores, k)
+        return rows[best], scores[best]
+
+    def save(self, directory):
+        self._write_meta(directory, dim=int(self.centroids.shape[1]), nlist=int(self.centroids.shape[0]), nprobe=self.nprobe)
+        np.savez(os.path.join(directory, "ivf.npz"), centroids=self.centroids,
+                 list_offsets=self.list_offsets, list_members=self.list_members)
+
+    @classmethod
+    def load(cls, directory, meta):
+        data = np.load(os.path.join(directory, "ivf.npz"))
+        ids = np.load(os.path.join(directory, INDEX_IDS_FILE))
+        return cls(ids, data["centroids"], data["list_offsets"], data["list_members"], nprobe=meta.get("nprobe", 8))
+
+    def describe(self):
+        return {"kind": self.kind, "nlist": int(self.centroids.shape[0]), "nprobe": self.nprobe}
+
+
+class HNSWIndex(_IdMappedIndex):
+    """
+    HNSW graph index (requires `hnswlib`). `ef_search` trades recall for latency at query time;
+    `M` and `ef_construction` are fixed at build time.
+    """
+    kind = "hnsw"
+
+    def __init__(self, ids, graph, ef_search=64):
+        super().__init__(ids)
+        self.graph = graph
+        self.ef_search = ef_search
+        self.graph.set_ef(ef_search)
+
+    @classmethod
+    def build(cls, vectors, ids, M=16, ef_construction=200, ef_search=64, num_threads=-1):
+        if hnswlib is None:
+            raise ImportError("hnswlib is not installed. Install it with: pip install hnswlib")
+        graph = hnswlib.Index(space="ip", dim=vectors.shape[1])
+        graph.init_index(max_elements=vectors.shape[0], ef_construction=ef_construction, M=M)
+        graph.add_items(vectors, np.arange(vectors.shape[0]), num_threads=num_threads)
+        return cls(ids, graph, ef_search=ef_search)
+
+    def set_ef_search(self, ef_search):
+        self.ef_search = ef_search
+        self.graph.set_ef(ef_search)
+
+    def search(self, query, k):
+        if self._rows is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        fetch = min(k, len(self.ids))
+        while True:
+            # ef is only set at load (set_ef_search): the graph is shared by concurrent requests and snapshots,
+            # so changing it per query would race. hnswlib already searches with max(ef, k) for larger fetches.
+            labels, distances = self.graph.knn_query(query.reshape(1, -1), k=fetch)
+            rows = self._rows[labels[0]]
+            keep = rows >= 0
+            # Products dropped from the catalog since the build can crowd out live ones; widen and retry
+            if keep.sum() >= k or fetch >= len(self.ids):
+                break
+            fetch = min(fetch * 2, len(self.ids))
+        scores = (1.0 - distances[0]).astype(np.float32) # "ip" space returns 1 - inner product
+        return rows[keep][:k], scores[keep][:k]
+
+    def save(self, directory):
+        self._write_meta(directory, dim=int(self.graph.dim), ef_search=self.ef_search)
+        self.graph.save_index(os.path.join(directory, "hnsw.bin"))
+
+    @classmethod
+    def load(cls, directory, meta):
+        if hnswlib is None:
+            raise ImportError("hnswlib is not installed. Install it with: pip install hnswlib")
+        ids = np.load(os.path.join(directory, INDEX_IDS_FILE))
+        graph = hnswlib.Index(space="ip", dim=meta["dim"])
+        graph.load_index(os.path.join(directory, "hnsw.bin"), max_elements=len(ids))
+        return cls(ids, graph, ef_search=meta.get("ef_search", 64))
+
+    def describe(self):
+        return {"kind": self.kind, "ef_search": self.ef_search}
+
+
+class OverlayIndex:
+    """
+    An index built offline plus an exact scan over `delta_rows`: catalog rows the base index does not
+    cover or holds an outdated vector for (products added or re-embedded since it was built).
+    Keeps a hot-reloaded catalog fully searchable until the base index is rebuilt.
+    """
+    kind = "overlay"
+
+    def __init__(self, base, matrix, delta_rows, shadowed_count=0):
+        self.base = base
+        self._matrix = matrix
+        self.delta_rows = np.asarray(delta_rows, dtype=np.int64)
+        self._in_delta = np.zeros(matrix.shape[0], dtype=bool)
+        self._in_delta[self.delta_rows] = True
+        self.shadowed_count = shadowed_count # Delta rows the base index can still return (with a stale vector)
+
+    def search(self, query, k):
+        # Over-fetch from the base so that dropping its stale hits still leaves k candidates
+        rows, scores = self.base.search(query, k + self.shadowed_count)
+        keep = ~self._in_delta[rows]
+        delta_scores = self._matrix[self.delta_rows] @ query
+        delta_best = _top_k(delta_scores, k)
+        rows = np.concatenate([rows[keep][:k], self.delta_rows[delta_best]])
+        scores = np.concatenate([scores[keep][:k], delta_scores[delta_best]])
+        best = _top_k(scores, k)
+        return rows[best], scores[best]
+
+    def save(self, directory):
+        pass # Only the base index is persisted (build_vector_index.py)
+
+    def describe(self):
+        return {"kind": self.kind, "base": self.base.describe(), "delta_rows": int(len(self.delta_rows))}
+
+
+INDEX_TYPES = {"flat": FlatIndex, "ivf": IVFIndex, "hnsw": HNSWIndex}
+
+def build_index(kind, vectors, ids, **params):
+    """Builds an index of the given kind over L2-normalized `vectors` labelled by `ids`."""
+    if kind == "flat":
+        index = FlatIndex()
+        index.attach(vectors, ids)
+        return index
+    if kind not in INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type '{kind}'. Choose from: {', '.join(INDEX_TYPES)}")
+    return INDEX_TYPES[kind].build(vectors, ids, **params)
+
+def load_index(directory):
+    """Loads an index saved with save_index(). Raises FileNotFoundError if none exists."""
+    with open(os.path.join(directory, INDEX_META_FILE), "r") as f:
+        meta = json.load(f)
+    kind = meta.get("kind")
+    if kind not in ("ivf", "hnsw"):
+        raise ValueError(f"Unsupported saved vector index type '{kind}'")
+    return INDEX_TYPES[kind].load(directory, meta)
+
+def evaluate_recall(index, matrix, k=10, num_queries=200, seed=0):
+    """
+    Compares `index` against exact search over `matrix` (which the index must be attached to),
+    using catalog vectors as queries. Returns recall@k and mean per-query latency of both.
+    """
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(matrix.shape[0], size=min(num_queries, matrix.shape[0]), replace=False)
+    exact = FlatIndex()
+    exact.attach(matrix, None)
+
+    hits, exact_time, index_time = 0, 0.0, 0.0
+    for row in query_rows:
+        query = matrix[row]
+        t0 = time.perf_counter()
+        expected, _ = exact.search(query, k)
+        t1 = time.perf_counter()
+        found, _ = index.search(query, k)
+        t2 = time.perf_counter()
+        exact_time += t1 - t0
+        index_time += t2 - t1
+        hits += len(set(expected.tolist()) & set(found.tolist()))
+
+    total = max(1, len(query_rows) * min(k, matrix.shape[0]))
+    return {
+        "index": index.describe(), "k": k, "num_queries": int(len(query_rows)),
+        "recall_at_k": hits / total,
+        "exact_ms_per_query": 1000.0 * exact_time / max(1, len(query_rows)),
+        "index_ms_per_query": 1000.0 * index_time / max(1, len(query_rows)),
+    }
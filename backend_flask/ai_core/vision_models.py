@@ -1,68 +1,342 @@
 # backend_flask/ai_core/vision_models.py
 import os
+import io
 import base64
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, Future, TimeoutError as FuturesTimeoutError
+import numpy as np
 from PIL import Image
-import torch
-from transformers import ViTImageProcessor, ViTModel
-import openai as openai_sdk # Keep aliasing
 from flask import current_app # To access app.logger and config
+# torch, transformers and openai take seconds to import, so they are imported on first use
+# (load_vit_model / get_image_description_openai) rather than when the app module loads.
 
 # --- ViT Model Loading (Moved here) ---
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+DEVICE = None # "cuda" or "cpu", resolved by load_vit_model()
 VIT_MODEL_NAME = 'google/vit-base-patch16-224-in21k'
 image_processor_vit = None
 vit_model_instance = None # Renamed to avoid conflict if vit_model is used as a var name
+_vit_load_lock = threading.Lock() # Warm-up and the first requests may race to load the model
+# Opt-in low-latency inference: "fp32" (default) is the reference; "int8" applies dynamic int8 quantization
+# to the Linear layers (CPU only); "bf16" runs the forward pass under bfloat16 autocast. Compare the modes
+# with evaluate_vit_inference.py before enabling one.
+VIT_INFERENCE_MODES = ("fp32", "int8", "bf16")
+_REQUESTED_INFERENCE_MODE = os.getenv("VIT_INFERENCE_MODE", "fp32").lower()
+VIT_INFERENCE_MODE = _REQUESTED_INFERENCE_MODE if _REQUESTED_INFERENCE_MODE in VIT_INFERENCE_MODES else "fp32"
+# Embeddings from different modes are close but not interchangeable, so the catalog embedding cache and the
+# per-image analysis cache are keyed by this instead of the bare model name.
+VIT_EMBEDDING_SPACE = VIT_MODEL_NAME if VIT_INFERENCE_MODE == "fp32" else f"{VIT_MODEL_NAME}#{VIT_INFERENCE_MODE}"
+VIT_NUM_THREADS = int(os.getenv("VIT_NUM_THREADS", "0")) # torch intra-op threads; 0 keeps torch's default
+VIT_INTEROP_THREADS = int(os.getenv("VIT_INTEROP_THREADS", "0")) # torch inter-op threads; 0 keeps torch's default
+VIT_BATCH_SIZE = int(os.getenv("VIT_BATCH_SIZE", "32"))
+VIT_PREPROCESS_WORKERS = int(os.getenv("VIT_PREPROCESS_WORKERS", str(min(8, os.cpu_count() or 1))))
+# Query images embedded concurrently (extract_vit_features) share forward passes: the first image in an idle
+# queue waits up to VIT_MICROBATCH_MAX_WAIT_MS for others, up to VIT_MICROBATCH_MAX_BATCH per pass. 1 disables it.
+VIT_MICROBATCH_MAX_BATCH = int(os.getenv("VIT_MICROBATCH_MAX_BATCH", "8"))
+VIT_MICROBATCH_MAX_WAIT_MS = float(os.getenv("VIT_MICROBATCH_MAX_WAIT_MS", "5"))
+VIT_MICROBATCH_TIMEOUT_SECONDS = float(os.getenv("VIT_MICROBATCH_TIMEOUT_SECONDS", "30")) # Caller gives up and gets None
+# Images sent to OpenAI Vision are downscaled and re-encoded as JPEG; GPT-4o tiles at 512px and
+# rescales anything larger anyway, so full-resolution uploads only cost bandwidth and latency.
+VISION_PAYLOAD_MAX_SIDE = int(os.getenv("VISION_PAYLOAD_MAX_SIDE", "1024"))
+VISION_PAYLOAD_MAX_BYTES = int(os.getenv("VISION_PAYLOAD_MAX_BYTES", str(512 * 1024)))
+
+def configure_torch_threads():
+    """Applies VIT_NUM_THREADS / VIT_INTEROP_THREADS. Returns (intra-op, inter-op) thread counts in effect."""
+    import torch
+    if VIT_NUM_THREADS > 0:
+        torch.set_num_threads(VIT_NUM_THREADS)
+    if VIT_INTEROP_THREADS > 0:
+        try:
+            torch.set_num_interop_threads(VIT_INTEROP_THREADS)
+        except RuntimeError: # Only settable before torch starts any inter-op work
+            pass
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+def build_vit_model(mode=None):
+    """
+    Loads the ViT processor and model prepared for an inference mode (default VIT_INFERENCE_MODE).
+    Returns (processor, model, device). Raises on failure.
+    """
+    import torch
+    from transformers import ViTImageProcessor, ViTModel
+    mode = mode or VIT_INFERENCE_MODE
+    # Dynamically quantized kernels only exist for CPU
+    device = "cpu" if mode == "int8" or not torch.cuda.is_available() else "cuda"
+    processor = ViTImageProcessor.from_pretrained(VIT_MODEL_NAME)
+    model = ViTModel.from_pretrained(VIT_MODEL_NAME).to(device)
+    model.eval()
+    if mode == "int8":
+        model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return processor, model, device
+
+def vit_forward(model, pixel_values, mode=None):
+    """CLS-token embeddings (float32 array, one row per image) for a batch of preprocessed pixel values."""
+    import torch
+    mode = mode or VIT_INFERENCE_MODE
+    with torch.inference_mode():
+        if mode == "bf16":
+            with torch.autocast(device_type=pixel_values.device.type, dtype=torch.bfloat16):
+                outputs = model(pixel_values=pixel_values)
+        else:
+            outputs = model(pixel_values=pixel_values)
+        return outputs.last_hidden_state[:, 0, :].float().cpu().numpy()
 
 def load_vit_model():
-    global image_processor_vit, vit_model_instance
-    if image_processor_vit is None or vit_model_instance is None:
+    global image_processor_vit, vit_model_instance, DEVICE
+    if image_processor_vit is not None and vit_model_instance is not None:
+        return image_processor_vit, vit_model_instance
+    with _vit_load_lock:
+        if image_processor_vit is None or vit_model_instance is None:
+            try:
+                if _REQUESTED_INFERENCE_MODE != VIT_INFERENCE_MODE:
+                    current_app.logger.warning(f"Unknown VIT_INFERENCE_MODE '{_REQUESTED_INFERENCE_MODE}'. "
+                                               f"Choose from: {', '.join(VIT_INFERENCE_MODES)}. Using fp32.")
+                intra_threads, interop_threads = configure_torch_threads()
+                current_app.logger.info(f"Loading ViT model: {VIT_MODEL_NAME} ({VIT_INFERENCE_MODE}, "
+                                        f"{intra_threads} intra-op / {interop_threads} inter-op threads)")
+                image_processor_vit, vit_model_instance, DEVICE = build_vit_model()
+                current_app.logger.info(f"Successfully loaded ViT model: {VIT_MODEL_NAME} on device: {DEVICE}")
+            except Exception as e:
+                current_app.logger.error(f"Error loading ViT model ({VIT_MODEL_NAME}): {e}. ViT features will be impaired.")
+                image_processor_vit = None # Ensure they are None on failure
+                vit_model_instance = None
+    return image_processor_vit, vit_model_instance
+
+
+class MicroBatcher:
+    """
+    Inference scheduler for query embeddings. Request threads preprocess their own image, queue the pixel
+    array and wait on a Future; one scheduler thread takes the oldest queued image, collects whatever else
+    arrives within `max_wait_ms` (up to `max_batch` images), runs them as a single forward pass and hands
+    each caller its row. Images that queue up while a pass is running go into the next one without waiting.
+    """
+
+    def __init__(self, max_batch, max_wait_ms):
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"batches": 0, "images": 0, "failed_batches": 0, "max_queue_depth": 0,
+                       "queue_wait_ms_total": 0.0, "forward_ms_total": 0.0}
+        self._batch_sizes = {} # images per forward pass -> number of passes
+
+    def submit(self, pixel_array):
+        """Queues one preprocessed (3, H, W) image; the Future resolves to its 1-D embedding."""
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="vit-microbatch", daemon=True)
+                    self._thread.start()
+        future = Future()
+        self._queue.put((pixel_array, future, time.perf_counter()))
+        depth = self._queue.qsize()
+        with self._stats_lock:
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], depth)
+        return future
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait()) # Already queued: never wait for these
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            try:
+                self._run_batch(batch)
+            except Exception as e: # One bad batch must not take down the thread every caller waits on
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _run_batch(self, batch):
+        import torch # Already imported by load_vit_model() before anything is submitted
+        # Callers that timed out cancelled their futures; the rest can no longer be cancelled from here on
+        batch = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        started = time.perf_counter()
         try:
-            current_app.logger.info(f"Loading ViT model: {VIT_MODEL_NAME} on device: {DEVICE}")
-            image_processor_vit = ViTImageProcessor.from_pretrained(VIT_MODEL_NAME)
-            vit_model_instance = ViTModel.from_pretrained(VIT_MODEL_NAME).to(DEVICE)
-            vit_model_instance.eval()
-            current_app.logger.info(f"Successfully loaded ViT model: {VIT_MODEL_NAME}")
+            pixel_values = torch.from_numpy(np.stack([pixel_array for pixel_array, _, _ in batch])).to(DEVICE)
+            features = vit_forward(vit_model_instance, pixel_values) # CLS tokens
+            for row, (_, future, _) in enumerate(batch):
+                if not future.done():
+                    future.set_result(features[row].copy())
+            failed = False
         except Exception as e:
-            current_app.logger.error(f"Error loading ViT model ({VIT_MODEL_NAME}): {e}. ViT features will be impaired.")
-            image_processor_vit = None # Ensure they are None on failure
-            vit_model_instance = None
-    return image_processor_vit, vit_model_instance
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            failed = True
+        finished = time.perf_counter()
+        with self._stats_lock:
+            self._stats["batches"] += 1
+            self._stats["images"] += len(batch)
+            self._stats["failed_batches"] += failed
+            self._stats["queue_wait_ms_total"] += 1000.0 * sum(started - queued_at for _, _, queued_at in batch)
+            self._stats["forward_ms_total"] += 1000.0 * (finished - started)
+            self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            batch_sizes = {str(size): count for size, count in sorted(self._batch_sizes.items())}
+        batches, images = stats["batches"], stats["images"]
+        return {
+            "max_batch": self.max_batch, "max_wait_ms": 1000.0 * self.max_wait,
+            "queue_depth": self._queue.qsize(), "max_queue_depth": stats["max_queue_depth"],
+            "batches": batches, "images": images, "failed_batches": stats["failed_batches"],
+            "mean_batch_size": images / batches if batches else 0.0, "batch_sizes": batch_sizes,
+            "mean_queue_wait_ms": stats["queue_wait_ms_total"] / images if images else 0.0,
+            "mean_forward_ms": stats["forward_ms_total"] / batches if batches else 0.0,
+        }
+
+
+_query_batcher = MicroBatcher(VIT_MICROBATCH_MAX_BATCH, VIT_MICROBATCH_MAX_WAIT_MS)
+
+def _reset_batcher_after_fork():
+    # The scheduler thread does not survive fork(); each worker process starts its own on first use
+    global _query_batcher
+    _query_batcher = MicroBatcher(VIT_MICROBATCH_MAX_BATCH, VIT_MICROBATCH_MAX_WAIT_MS)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_batcher_after_fork)
+
+def get_vit_batching_stats():
+    return _query_batcher.get_stats()
 
 def extract_vit_features(image_path_or_pil_image):
+    """
+    1-D ViT embedding of one query image, or None on failure. Preprocessing runs on the calling thread;
+    the forward pass is shared with other concurrent callers through the micro-batcher.
+    """
     processor, model = load_vit_model() # Ensure models are loaded
     if processor is None or model is None:
         current_app.logger.error("ViT model or processor not available for feature extraction.")
         return None
     try:
-        if isinstance(image_path_or_pil_image, str):
-            img = Image.open(image_path_or_pil_image).convert("RGB")
-        else: # Assuming PIL Image
-            img = image_path_or_pil_image.convert("RGB")
-
-        inputs = processor(images=img, return_tensors="pt").to(DEVICE)
-        with torch.no_grad():
-            outputs = model(**inputs)
-        features = outputs.last_hidden_state[:, 0, :].cpu().numpy() # CLS token
-        return features.flatten()
+        pixel_array = _preprocess_image_for_vit(processor, image_path_or_pil_image)
+        if _query_batcher.max_batch > 1:
+            future = _query_batcher.submit(pixel_array)
+            try:
+                return future.result(timeout=VIT_MICROBATCH_TIMEOUT_SECONDS)
+            except FuturesTimeoutError:
+                future.cancel() # Dropped from its batch unless the forward pass already started
+                current_app.logger.error(f"ViT embedding timed out after {VIT_MICROBATCH_TIMEOUT_SECONDS}s in the micro-batch queue.")
+                return None
+        import torch # Already imported by load_vit_model()
+        return vit_forward(model, torch.from_numpy(pixel_array[None]).to(DEVICE))[0] # CLS token
     except Exception as e:
         current_app.logger.error(f"Error extracting ViT features: {e}")
         return None
 
-def get_image_description_openai(image_path, openai_client_instance):
+def _preprocess_image_for_vit(processor, image_path_or_pil_image):
+    """Decodes and preprocesses one image into a (3, H, W) pixel array. Runs on a worker thread."""
+    if isinstance(image_path_or_pil_image, str):
+        with Image.open(image_path_or_pil_image) as raw_img:
+            img = raw_img.convert("RGB")
+    else: # Assuming PIL Image
+        img = image_path_or_pil_image.convert("RGB")
+    return processor(images=img, return_tensors="np")["pixel_values"][0]
+
+def extract_vit_features_batch(image_paths_or_pil_images, batch_size=None, num_workers=None, prefetch_batches=2):
+    """
+    Batched version of extract_vit_features.
+    Image decoding and ViTImageProcessor preprocessing run in a thread pool and are prefetched
+    `prefetch_batches` batches ahead of the model, which runs one forward pass per batch.
+    Returns a list aligned with the input: a 1-D feature vector per image, or None if that image failed.
+    """
+    items = list(image_paths_or_pil_images)
+    if not items:
+        return []
+    processor, model = load_vit_model() # Ensure models are loaded
+    if processor is None or model is None:
+        current_app.logger.error("ViT model or processor not available for batch feature extraction.")
+        return [None] * len(items)
+
+    import torch # Already imported by load_vit_model()
+    batch_size = max(1, batch_size or VIT_BATCH_SIZE)
+    num_workers = max(1, num_workers or VIT_PREPROCESS_WORKERS)
+    batch_starts = list(range(0, len(items), batch_size))
+    results = [None] * len(items)
+
+    with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="vit-preprocess") as executor:
+        pending = deque()
+        def submit_batch(start):
+            pending.append((start, [executor.submit(_preprocess_image_for_vit, processor, item)
+                                    for item in items[start:start + batch_size]]))
+
+        next_batch = 0
+        while next_batch < len(batch_starts) and len(pending) < prefetch_batches + 1:
+            submit_batch(batch_starts[next_batch]); next_batch += 1
+
+        while pending:
+            start, futures = pending.popleft()
+            if next_batch < len(batch_starts): # Keep the preprocessing pool busy while the model runs
+                submit_batch(batch_starts[next_batch]); next_batch += 1
+
+            pixel_arrays, indices = [], []
+            for offset, future in enumerate(futures):
+                try:
+                    pixel_arrays.append(future.result())
+                    indices.append(start + offset)
+                except Exception as e:
+                    label = items[start + offset] if isinstance(items[start + offset], str) else "PIL image"
+                    current_app.logger.error(f"Error preprocessing image for ViT ({label}): {e}")
+            if not pixel_arrays:
+                continue
+
+            try:
+                pixel_values = torch.from_numpy(np.stack(pixel_arrays)).to(DEVICE)
+                features = vit_forward(model, pixel_values) # CLS tokens
+                for row, idx in enumerate(indices):
+                    results[idx] = features[row]
+            except Exception as e:
+                current_app.logger.error(f"Error extracting ViT features for batch starting at {start}: {e}")
+
+    return results
+
+def encode_image_for_vision(image_path_or_pil_image):
+    """Returns a base64 JPEG of the image, at most VISION_PAYLOAD_MAX_SIDE px and (best effort) VISION_PAYLOAD_MAX_BYTES."""
+    if isinstance(image_path_or_pil_image, str):
+        with Image.open(image_path_or_pil_image) as raw_img:
+            img = raw_img.convert("RGB")
+    else: # Assuming PIL Image
+        img = image_path_or_pil_image.convert("RGB")
+    if max(img.size) > VISION_PAYLOAD_MAX_SIDE:
+        img.thumbnail((VISION_PAYLOAD_MAX_SIDE, VISION_PAYLOAD_MAX_SIDE), Image.LANCZOS)
+    for quality in (85, 75, 60, 45):
+        buffer = io.BytesIO()
+        img.save(buffer, format="JPEG", quality=quality, optimize=True)
+        if buffer.tell() <= VISION_PAYLOAD_MAX_BYTES:
+            break
+    return base64.b64encode(buffer.getvalue()).decode('utf-8')
+
+def get_image_description_openai(image_path_or_pil_image, openai_client_instance):
     if not openai_client_instance: # Check if client was successfully initialized in app.py
         current_app.logger.warning("OpenAI client not available. Skipping OpenAI Vision.")
         return "Image description not available (OpenAI client issue)."
+    import openai as openai_sdk # Keep aliasing; already imported wherever the client was created
     try:
-        with open(image_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-
-        # Determine image type (simple check, can be improved)
+        base64_image = encode_image_for_vision(image_path_or_pil_image)
         image_type = "image/jpeg"
-        if image_path.lower().endswith(".png"):
-            image_type = "image/png"
-        elif image_path.lower().endswith(".gif"):
-            image_type = "image/gif"
-        # Add more types if needed
 
         response = openai_client_instance.chat.completions.create(
             model="gpt-4o",
@@ -1,10 +1,15 @@
 import os
 import uuid
 import json
+import time
+import hmac
+import threading
+import numpy as np
 from datetime import datetime # For order timestamps
 from flask import (
     Flask, request, jsonify, render_template, url_for, 
-    current_app, send_from_directory, flash, redirect, session
+    current_app, send_from_directory, flash, redirect, session,
+    Response, stream_with_context
 )
 from werkzeug.utils import secure_filename
 # from werkzeug.security import generate_password_hash, check_password_hash # Using bcrypt
@@ -19,23 +24,26 @@ from flask_login import LoginManager, UserMixin, login_user, logout_user, login_
 # Custom Modules
 from . import db  # For SQLite connection
 from .models import User # Your User model for SQLite
-from .ai_core.vision_models import load_vit_model, extract_vit_features, get_image_description_openai
-from .ai_core.language_models import load_spacy_model, extract_keywords_spacy, get_refined_search_gemini
-from .ai_core.product_catalog import load_and_preprocess_catalog, get_catalog_products
+from .uploads import QueryImage, PERSIST_UPLOADS, start_upload_reaper
+from .warmup import WarmUp, WARM_UP_MODE
+from .ai_core.vision_models import load_vit_model, extract_vit_features, get_image_description_openai, get_vit_batching_stats
+from .ai_core.language_models import (
+    load_spacy_model, extract_keywords_spacy, get_refined_search_gemini, get_gemini_cache_stats, get_spacy_cache_stats
+)
+from .ai_core.cache import TTLCache
+from .ai_core.image_cache import image_analysis_cache
+from .ai_core.pipeline import StageGraph, get_pipeline_stats
+from .ai_core.product_catalog import (
+    load_and_preprocess_catalog, get_catalog_snapshot, get_catalog_products, get_catalog_file_path, get_products_by_ids
+)
 
-# OpenAI SDK
-import openai as openai_sdk
+# OpenAI SDK and Google Generative AI: imported and configured by the warm-up (see the end of this module)
 openai_client = None 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-
-# Google Generative AI
-import google.generativeai as genai
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
 # SQLite specific imports
 import sqlite3 
-import numpy as np # Keep for ViT
-from sklearn.metrics.pairwise import cosine_similarity # Keep for ViT
 # from PIL import Image # Already imported in vision_models.py if needed there directly
 
 # --- Flask App Initialization & Configuration ---
@@ -60,26 +68,12 @@ db.init_app(app) # Initialize SQLite database
 def load_user(user_id_str):
     return User.get_by_id(user_id_str)
 
-# --- Initialize AI Clients, Models, and Product Catalog ---
+# --- Upload Folder (AI clients, models and the catalog are loaded by the warm-up at the end of this module) ---
 with app.app_context():
     upload_folder_path = os.path.join(current_app.root_path, app.config['UPLOAD_FOLDER'])
     os.makedirs(upload_folder_path, exist_ok=True)
     current_app.logger.info(f"Upload folder ensured at: {upload_folder_path}")
 
-    if not OPENAI_API_KEY: current_app.logger.warning("OPENAI_API_KEY missing.")
-    else:
-        try: openai_client = openai_sdk.OpenAI(api_key=OPENAI_API_KEY); current_app.logger.info("OpenAI client OK.")
-        except Exception as e: current_app.logger.error(f"OpenAI client init error: {e}"); openai_client = None
-    
-    if not GOOGLE_API_KEY: current_app.logger.warning("GOOGLE_API_KEY missing.")
-    else:
-        try: genai.configure(api_key=GOOGLE_API_KEY); current_app.logger.info("Gemini configured OK.")
-        except Exception as e: current_app.logger.error(f"Gemini config error: {e}")
-
-    load_vit_model()
-    load_spacy_model()
-    load_and_preprocess_catalog()
-
 # --- Helper Function ---
 def allowed_file(filename):
     if not filename or '.' not in filename: return False
@@ -87,63 +81,115 @@ def allowed_file(filename):
     return filename.rsplit('.', 1)[1].lower() in app.config.get('ALLOWED_EXTENSIONS', {'png', 'jpg', 'jpeg', 'gif'})
 
 
-# --- Core Recommendation Logic (Incorporating User Preferences) ---
-def generate_final_recommendations(query_image_path=None, text_prompt="", top_k=10, user_for_prefs=None):
-    current_catalog_with_embeddings = get_catalog_products()
-    if not current_catalog_with_embeddings: 
-        current_app.logger.error("Product catalog is empty or not loaded in generate_final_recommendations.")
-        return [], "Error: Product catalog is critically empty.", {"error": "Product catalog unavailable."}
+def recommendations_not_ready_response():
+    """503 for AI routes while the warm-up is still loading models and the catalog; None once ready."""
+    if warm_up.is_ready():
+        return None
+    return jsonify({"error": "Recommendations are still warming up. Please retry shortly."}), 503, {"Retry-After": "5"}
+
+def is_usable_image_description(description):
+    return bool(description) and "Error" not in description and "N/A" not in description and "not available" not in description.lower()
+
+
+# --- Recommendation Pipeline Stages (run concurrently by generate_final_recommendations) ---
+def lookup_image_analysis(query_image):
+    """Returns (cache keys, cached analysis) so repeat uploads skip both the OpenAI call and the ViT pass."""
+    image_cache_keys = image_analysis_cache.compute_keys(query_image.image_bytes, pil_image=query_image.image)
+    return image_cache_keys, image_analysis_cache.lookup(image_cache_keys)
+
+def describe_query_image(query_image, image_analysis):
+    image_cache_keys, cached_analysis = image_analysis
+    if cached_analysis.get("description"):
+        return cached_analysis["description"]
+    if not openai_client:
+        current_app.logger.warning("OpenAI client not available for image description.")
+        return "OpenAI client not available for image description."
+    openai_description = get_image_description_openai(query_image.image, openai_client)
+    if is_usable_image_description(openai_description):
+        image_analysis_cache.store(image_cache_keys, description=openai_description)
+    return openai_description
+
+def find_visual_recommendations(query_image, image_analysis, limit, catalog_snapshot):
+    image_cache_keys, cached_analysis = image_analysis
+    query_embedding = cached_analysis.get("embedding")
+    if query_embedding is None:
+        query_embedding = extract_vit_features(query_image.image)
+        if query_embedding is not None:
+            image_analysis_cache.store(image_cache_keys, embedding=query_embedding)
+    if query_embedding is None:
+        current_app.logger.warning(f"Could not get ViT embedding for query image: {query_image.filename}")
+        return []
 
-    openai_description = "N/A (OpenAI not used or no image provided)"
-    gemini_refinement_data = {"error": "Gemini not used or input insufficient."}
     visual_recommendations = []
-    user_preferences = user_for_prefs.get_preferences() if user_for_prefs and hasattr(user_for_prefs, 'get_preferences') else {}
-
-    if query_image_path:
-        if openai_client:
-            openai_description = get_image_description_openai(query_image_path, openai_client)
-        else:
-            current_app.logger.warning("OpenAI client not available for image description.")
-            openai_description = "OpenAI client not available for image description."
-        
-        query_embedding = extract_vit_features(query_image_path)
-        if query_embedding is not None:
-            db_embeddings_tuples = [(p["embedding"], p) for p in current_catalog_with_embeddings if p.get("embedding") is not None]
-            if db_embeddings_tuples:
-                db_embeddings = np.array([t[0] for t in db_embeddings_tuples])
-                products_with_embeddings = [t[1] for t in db_embeddings_tuples]
-                
-                similarities = cosine_similarity(query_embedding.reshape(1, -1), db_embeddings)[0]
-                sorted_indices = np.argsort(similarities)[::-1]
-
-                for i in sorted_indices:
-                    if len(visual_recommendations) < top_k * 2:
-                        product = products_with_embeddings[i].copy()
-                        similarity_score = float(similarities[i])
-                        product["recommendationReason"] = f"Visually similar (ViT Score: {similarity_score:.2f})"
-                        product["detailedReasons"] = [f"ViT Similarity: {similarity_score:.2f}"]
-                        product["visual_score"] = similarity_score
-                        visual_recommendations.append(product)
-            else:
-                current_app.logger.warning("No ViT embeddings found in the product catalog for visual comparison.")
-        else:
-             current_app.logger.warning(f"Could not get ViT embedding for query image: {query_image_path}")
-    
-    spacy_keywords = extract_keywords_spacy(text_prompt) if text_prompt else []
-    current_desc_for_gemini = openai_description if "Error" not in openai_description and "N/A" not in openai_description and "not available" not in openai_description.lower() else "No specific visual input provided."
+    similar_products = catalog_snapshot.search_similar(query_embedding, top_k=limit)
+    if not similar_products:
+        current_app.logger.warning("No ViT embeddings found in the product catalog for visual comparison.")
+    for product, similarity_score in similar_products: # Fresh dict views of the catalog products
+        product["recommendationReason"] = f"Visually similar (ViT Score: {similarity_score:.2f})"
+        product["detailedReasons"] = [f"ViT Similarity: {similarity_score:.2f}"]
+        product["visual_score"] = similarity_score
+        visual_recommendations.append(product)
+    return visual_recommendations
+
+def refine_query(text_prompt, openai_description, visual_recommendations):
+    openai_description = openai_description or "N/A (OpenAI not used or no image provided)"
+    current_desc_for_gemini = openai_description if is_usable_image_description(openai_description) else "No specific visual input provided."
     product_ctx_str = "Initial visual ideas: " + ", ".join([p['name'] for p in visual_recommendations[:3]]) if visual_recommendations else ""
-    
     if text_prompt or current_desc_for_gemini != "No specific visual input provided.":
-        gemini_refinement_data = get_refined_search_gemini(current_desc_for_gemini, text_prompt, product_ctx_str)
-    else:
-        gemini_refinement_data = {"message": "Insufficient input for Gemini refinement."}
+        return get_refined_search_gemini(current_desc_for_gemini, text_prompt, product_ctx_str)
+    return {"message": "Insufficient input for Gemini refinement."}
 
-    candidate_products = visual_recommendations if visual_recommendations else [p.copy() for p in current_catalog_with_embeddings]
-    if not candidate_products:
-        current_app.logger.info("No candidate products (visual or catalog) for recommendation.")
-        return [], openai_description, gemini_refinement_data
+# --- Core Recommendation Logic (Incorporating User Preferences) ---
+def generate_final_recommendations(query_image=None, text_prompt="", top_k=10, user_for_prefs=None):
+    user_preferences = user_for_prefs.get_preferences() if user_for_prefs and hasattr(user_for_prefs, 'get_preferences') else {}
+    scored_recommendations, openai_description, gemini_refinement_data = score_recommendation_candidates(
+        query_image=query_image, text_prompt=text_prompt, top_k=top_k, user_preferences=user_preferences
+    )
+    return finalize_recommendations(scored_recommendations, top_k), openai_description, gemini_refinement_data
+
+def build_recommendation_pipeline(query_image, text_prompt, top_k, catalog_snapshot):
+    """
+    Independent stages (OpenAI vision, ViT search, spaCy) overlap; Gemini waits for the vision outputs.
+    Visual search runs against `catalog_snapshot`, the same catalog version the results are scored on.
+    """
+    pipeline = StageGraph("recommendations")
+    pipeline.add("spacy_keywords", lambda: extract_keywords_spacy(text_prompt) if text_prompt else [])
+    refine_deps = ()
+    if query_image is not None:
+        pipeline.add("image_cache_lookup", lambda: lookup_image_analysis(query_image))
+        pipeline.add("openai_description", lambda analysis: describe_query_image(query_image, analysis), deps=("image_cache_lookup",))
+        pipeline.add("visual_search", lambda analysis: find_visual_recommendations(query_image, analysis, top_k * 2, catalog_snapshot), deps=("image_cache_lookup",))
+        refine_deps = ("openai_description", "visual_search")
+    pipeline.add("gemini_refinement",
+                 lambda openai_desc=None, visual_recs=None: refine_query(text_prompt, openai_desc, visual_recs or []),
+                 deps=refine_deps)
+    return pipeline
+
+def score_recommendation_candidates(query_image=None, text_prompt="", top_k=10, user_preferences=None, stage_results=None, limit=None,
+                                    catalog_snapshot=None):
+    """
+    Runs the AI pipeline (unless its `stage_results` are passed in) and returns
+    (best `limit` (default top_k) scored candidates, best first, openai_description, gemini_refinement_data).
+    Scores are computed for all candidates at once over the catalog's columnar features;
+    product dicts and reasons are only built for the returned candidates.
+    Everything is read from one catalog snapshot (the current one unless given), so a concurrent reload
+    cannot mix positions from two catalog versions.
+    """
+    catalog_snapshot = catalog_snapshot or get_catalog_snapshot()
+    catalog = catalog_snapshot.store
+    catalog_features = catalog_snapshot.features
+    if not catalog or catalog_features is None:
+        current_app.logger.error("Product catalog is empty or not loaded in generate_final_recommendations.")
+        return [], "Error: Product catalog is critically empty.", {"error": "Product catalog unavailable."}
+
+    if stage_results is None:
+        stage_results = build_recommendation_pipeline(query_image, text_prompt, top_k, catalog_snapshot).run()
+
+    openai_description = stage_results.get("openai_description", "N/A (OpenAI not used or no image provided)")
+    visual_recommendations = stage_results.get("visual_search", [])
+    spacy_keywords = stage_results["spacy_keywords"]
+    gemini_refinement_data = stage_results["gemini_refinement"]
 
-    scored_recommendations = []
     all_search_keywords = set(text_prompt.lower().split())
     all_search_keywords.update(spacy_keywords)
 
@@ -152,55 +198,72 @@ def generate_final_recommendations(query_image_path=None, text_prompt="", top_k=
         gemini_refined_query_terms = gemini_refinement_data.get("refined_search_query", "").lower().split()
         if isinstance(gemini_key_attrs, list): all_search_keywords.update([attr.lower() for attr in gemini_key_attrs])
         all_search_keywords.update(gemini_refined_query_terms)
-    all_search_keywords = list(filter(None, all_search_keywords)) 
-
-    for product in candidate_products:
-        product_copy = product.copy()
-        score = product_copy.get("visual_score", 0.0) * 10.0
-        current_reasons = product_copy.get("detailedReasons", [])[:]
+    all_search_keywords = sorted(filter(None, all_search_keywords)) # Sorted so reasons and ties are deterministic
+    keyword_scores = catalog_snapshot.score_keywords(all_search_keywords) # Dense BM25 vector over catalog positions
+
+    preference_scores = catalog_features.preference_scores(user_preferences) # Dense over catalog positions
+
+    # Candidate catalog positions, with visual similarity aligned to them
+    if visual_recommendations:
+        visual_positions = catalog_snapshot.positions_of([p.get("id") for p in visual_recommendations])
+        known = visual_positions >= 0
+        visual_recommendations = [p for p, ok in zip(visual_recommendations, known) if ok]
+        candidate_positions = visual_positions[known]
+        visual_scores = np.array([p.get("visual_score", 0.0) for p in visual_recommendations], dtype=np.float64)
+    else:
+        candidate_positions = keyword_scores.matched_docs() if keyword_scores is not None else np.zeros(0, dtype=np.int64)
+        # Unmatched products score on preferences alone, so only the best-preferred of them can reach the top
+        # results; adding those keeps the ranking (and result count) of scoring the whole catalog
+        wanted = limit or top_k
+        unmatched = np.ones(len(catalog), dtype=bool)
+        unmatched[candidate_positions] = False
+        unmatched_positions = np.flatnonzero(unmatched)
+        preference_ranked = np.argsort(-preference_scores[unmatched_positions], kind="stable")
+        candidate_positions = np.union1d(candidate_positions, unmatched_positions[preference_ranked[:wanted]])
+        visual_scores = np.zeros(len(candidate_positions), dtype=np.float64)
+    if not len(candidate_positions):
+        current_app.logger.info("No candidate products (visual or catalog) for recommendation.")
+        return [], openai_description, gemini_refinement_data
 
-        if user_preferences:
-            liked_colors = user_preferences.get("liked_colors", {})
-            p_colors = [tag.lower() for tag in product_copy.get("color_tags", [])]
-            for color, count in liked_colors.items():
-                if color in p_colors: score += (count * 0.7)
+    final_scores = visual_scores * 10.0 + preference_scores[candidate_positions]
+    if keyword_scores is not None:
+        final_scores += keyword_scores.scores[candidate_positions] # BM25 over the catalog keyword index
+    best = np.argsort(-final_scores, kind="stable")[:limit or top_k]
 
-            interacted_categories = user_preferences.get("interacted_categories", [])
-            if product_copy.get("category", "").lower() in [cat.lower() for cat in interacted_categories]:
-                score += 2.5
-        
-        text_match_count = 0
-        product_text_corpus = (f"{product_copy.get('name','')} {product_copy.get('description','')} {product_copy.get('type','')} "
-                               f"{product_copy.get('category','')} {product_copy.get('style','')} {product_copy.get('material','')} "
-                               f"{' '.join(product_copy.get('color_tags',[]))}").lower()
-        matched_kw_for_this_product = [kw for kw in all_search_keywords if kw and kw in product_text_corpus]
-        text_match_count = len(set(matched_kw_for_this_product))
-        score += text_match_count * 2.5
-
-        if text_match_count > 0:
-            reason_str = f"Matches: {', '.join(list(set(matched_kw_for_this_product)))}"
+    scored_recommendations = []
+    for candidate in best:
+        position = int(candidate_positions[candidate])
+        # Visual results are already per-request dicts; catalog[position] materializes a fresh view
+        product_copy = visual_recommendations[candidate] if visual_recommendations else catalog[position]
+        current_reasons = product_copy.get("detailedReasons", [])[:]
+        matched_kw_for_this_product = keyword_scores.matched_keywords(position) if keyword_scores is not None else []
+        if matched_kw_for_this_product:
+            reason_str = f"Matches: {', '.join(matched_kw_for_this_product)}"
             current_reasons.append(reason_str)
             current_rec_reason = product_copy.get("recommendationReason", "")
             if "Visually similar" in current_rec_reason: product_copy["recommendationReason"] = f"{current_rec_reason} & {reason_str.lower()}"
             elif not current_rec_reason or current_rec_reason.startswith("N/A"): product_copy["recommendationReason"] = reason_str
             else: product_copy["recommendationReason"] = f"{current_rec_reason}, also {reason_str.lower()}"
-        
-        product_copy["final_score"] = score
-        product_copy["detailedReasons"] = list(set(current_reasons))
+
+        product_copy["final_score"] = float(final_scores[candidate])
+        product_copy["detailedReasons"] = list(dict.fromkeys(current_reasons))
         scored_recommendations.append(product_copy)
+    return scored_recommendations, openai_description, gemini_refinement_data
 
-    scored_recommendations.sort(key=lambda x: x.get("final_score", 0), reverse=True)
+def finalize_recommendations(scored_recommendations, top_k):
+    """Takes the top_k scored candidates (or popular fallbacks) and makes them JSON-safe for the client."""
+    catalog = get_catalog_products()
     final_recommendations_raw = scored_recommendations[:top_k]
     
-    if not final_recommendations_raw and current_catalog_with_embeddings:
-        final_recommendations_raw = [p.copy() for i, p in enumerate(current_catalog_with_embeddings) if i < top_k]
+    if not final_recommendations_raw and catalog:
+        final_recommendations_raw = [catalog[i] for i in range(min(top_k, len(catalog)))]
         for rec in final_recommendations_raw: 
             rec["recommendationReason"] = "Popular item (fallback)"
             rec["final_score"] = 0.1 
             
     final_recs_json_safe = []
     for rec_raw in final_recommendations_raw:
-        rec_json_safe = rec_raw.copy()
+        rec_json_safe = rec_raw.copy() # Candidates may be shared (homepage cache), so never mutate them
         rec_json_safe["imageUrl"] = rec_json_safe.get("images")[0] if rec_json_safe.get("images") else (rec_json_safe.get("imageUrl") or "/static/placeholder.png")
         base_reason = rec_json_safe.get("recommendationReason", "Recommended")
         final_score_val = rec_json_safe.get('final_score', 0.0)
@@ -210,82 +273,261 @@ def generate_final_recommendations(query_image_path=None, text_prompt="", top_k=
         elif "fallback" in base_reason.lower(): rec_json_safe["recommendationReason"] = base_reason
         elif not base_reason or base_reason == "Recommended": rec_json_safe["recommendationReason"] = "Considered (low relevance)"
         
-        if "embedding" in rec_json_safe: del rec_json_safe["embedding"]
         if "visual_score" in rec_json_safe: del rec_json_safe["visual_score"]
         
         final_recs_json_safe.append(rec_json_safe)
 
-    return final_recs_json_safe, openai_description, gemini_refinement_data
+    return final_recs_json_safe
+
+# --- Homepage Recommendations Cache ---
+# The anonymous homepage set is computed at startup and refreshed on a background schedule, so `/`
+# never waits on spaCy or Gemini. Logged-in users get a cheap preference rerank of the cached pool.
+HOMEPAGE_PROMPT = "trending fashion popular apparel"
+HOMEPAGE_TOP_K = 8
+HOMEPAGE_CANDIDATE_POOL = int(os.getenv("HOMEPAGE_CANDIDATE_POOL", "64"))
+HOMEPAGE_REFRESH_SECONDS = int(os.getenv("HOMEPAGE_REFRESH_SECONDS", "900"))
+homepage_cache = {"candidates": [], "anonymous": [], "generation": 0, "refreshed_at": None}
+homepage_user_cache = TTLCache(max_entries=4096, ttl_seconds=HOMEPAGE_REFRESH_SECONDS) # (user, prefs version, generation) -> recs
+
+def refresh_homepage_recommendations():
+    global homepage_cache
+    scored_recommendations, _, _ = score_recommendation_candidates(text_prompt=HOMEPAGE_PROMPT, top_k=HOMEPAGE_TOP_K,
+                                                                   limit=HOMEPAGE_CANDIDATE_POOL)
+    candidates = scored_recommendations[:HOMEPAGE_CANDIDATE_POOL]
+    # Publish a new dict in one assignment so readers never mix candidates and results from different refreshes
+    homepage_cache = {
+        "candidates": candidates, "anonymous": finalize_recommendations(candidates, HOMEPAGE_TOP_K),
+        "generation": homepage_cache["generation"] + 1, "refreshed_at": datetime.utcnow().isoformat(),
+    }
+    current_app.logger.info(f"Homepage recommendations refreshed ({len(candidates)} candidates, generation {homepage_cache['generation']}).")
+
+def get_homepage_recommendations(user_obj=None):
+    snapshot = homepage_cache
+    preferences_version, user_preferences = user_obj.get_preferences_versioned() if user_obj else (0, {})
+    if not user_preferences:
+        return snapshot["anonymous"] or finalize_recommendations([], HOMEPAGE_TOP_K)
+
+    cache_key = (user_obj.id, preferences_version, snapshot["generation"])
+    cached_recs = homepage_user_cache.get(cache_key)
+    if cached_recs is not None:
+        return cached_recs
+    reranked = []
+    boosts = get_catalog_snapshot().preference_scores([c.get("id") for c in snapshot["candidates"]], user_preferences)
+    for candidate, boost in zip(snapshot["candidates"], boosts.tolist()):
+        if boost:
+            candidate = candidate.copy()
+            candidate["final_score"] = candidate.get("final_score", 0.0) + boost
+            candidate["detailedReasons"] = candidate.get("detailedReasons", []) + ["Matches your preferences"]
+        reranked.append(candidate)
+    reranked.sort(key=lambda x: x.get("final_score", 0), reverse=True)
+    recs = finalize_recommendations(reranked, HOMEPAGE_TOP_K)
+    homepage_user_cache.set(cache_key, recs)
+    return recs
+
+def start_homepage_refresher(flask_app):
+    def refresh_loop():
+        while True:
+            time.sleep(HOMEPAGE_REFRESH_SECONDS)
+            with flask_app.app_context():
+                try:
+                    refresh_homepage_recommendations()
+                except Exception as e:
+                    flask_app.logger.error(f"Homepage recommendation refresh failed: {e}", exc_info=True)
+    threading.Thread(target=refresh_loop, name="homepage-refresher", daemon=True).start()
+
+# --- Catalog Hot Reload ---
+# Each worker holds its own catalog snapshot (only the embedding matrix is shared, as a memmap). The admin endpoint
+# reloads the worker that serves it; with several workers, enable the file watcher so every worker picks up
+# edits to the catalog JSON on its own.
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN") # Unset disables the admin endpoints (catalog reload, /api/metrics)
+CATALOG_WATCH_INTERVAL_SECONDS = int(os.getenv("CATALOG_WATCH_INTERVAL_SECONDS", "0")) # 0 disables the file watcher
+CATALOG_WARM_UP_RETRIES = int(os.getenv("CATALOG_WARM_UP_RETRIES", "3")) # Start-up retries with backoff (catalog file missing or half-written)
+
+def reload_catalog():
+    """
+    Reloads the catalog (embedding only new or changed products) and rebuilds the homepage set from it.
+    A successful reload also clears a failed catalog warm-up step, so the AI routes stop answering 503.
+    """
+    summary = load_and_preprocess_catalog()
+    if summary.get("swapped"):
+        refresh_homepage_recommendations()
+    if "error" not in summary and get_catalog_snapshot().version > 0:
+        warm_up.mark_ok("catalog")
+    return summary
+
+def catalog_file_stamp(catalog_file_path):
+    try:
+        stat = os.stat(catalog_file_path)
+        return stat.st_mtime_ns, stat.st_size
+    except OSError:
+        return None
+
+def start_catalog_watcher(flask_app):
+    """Polls the catalog JSON and reloads when it changes. Image-only edits and vector index rebuilds need the admin endpoint."""
+    with flask_app.app_context():
+        catalog_file_path = get_catalog_file_path()
+
+    def watch_loop():
+        last_stamp = catalog_file_stamp(catalog_file_path)
+        while True:
+            time.sleep(CATALOG_WATCH_INTERVAL_SECONDS)
+            stamp = catalog_file_stamp(catalog_file_path)
+            if stamp is None or stamp == last_stamp:
+                continue
+            with flask_app.app_context():
+                try:
+                    summary = reload_catalog()
+                    # A half-written file fails to parse; leave the stamp unset so the next poll retries
+                    last_stamp = None if "error" in summary else stamp
+                except Exception as e:
+                    flask_app.logger.error(f"Catalog reload failed: {e}", exc_info=True)
+                    last_stamp = None
+    threading.Thread(target=watch_loop, name="catalog-watcher", daemon=True).start()
 
 # --- Main Application Routes ---
 @app.route('/')
 def index_route(): # Renamed from index
     user_for_prefs = current_user if current_user.is_authenticated else None
-    recs, _, _ = generate_final_recommendations(
-        text_prompt="trending fashion popular apparel", top_k=8, user_for_prefs=user_for_prefs
-    )
+    recs = get_homepage_recommendations(user_for_prefs)
     return render_template('index.html', initial_recommendations=json.dumps(recs))
 
-@app.route('/upload_image', methods=['POST'])
-def upload_image_route():
+def read_uploaded_image():
+    """
+    Validates request.files['imageFile'] and decodes it once in memory (persisting it to UPLOAD_FOLDER
+    only when PERSIST_UPLOADS is on). Returns (QueryImage, None) or (None, error response).
+    """
     if 'imageFile' not in request.files:
         current_app.logger.warning("Upload attempt: 'imageFile' part missing from request.files")
-        return jsonify({"error": "No image file part provided in the request"}), 400
+        return None, (jsonify({"error": "No image file part provided in the request"}), 400)
     
     file = request.files['imageFile'] # Assign file object from the request
     
     if not file or not file.filename:
         current_app.logger.warning("Upload attempt: No file selected or filename is empty.")
-        return jsonify({"error": "No file selected or filename is empty"}), 400
-
-    # Now `file` is defined. Proceed to check if it's an allowed type.
-    if allowed_file(file.filename): # `file` is used here
-        filename = secure_filename(f"{uuid.uuid4()}_{file.filename}")
-        filepath = os.path.join(current_app.root_path, app.config['UPLOAD_FOLDER'], filename)
-        try:
-            file.save(filepath) # `file` is used here
-            current_app.logger.info(f"Uploaded image saved to: {filepath}")
-            prompt_text = request.form.get('prompt', '')
-            user_for_prefs = current_user if current_user.is_authenticated else None
-            
-            recs_json_safe, openai_desc, gemini_refine = generate_final_recommendations(
-                query_image_path=filepath, text_prompt=prompt_text, user_for_prefs=user_for_prefs
-            )
-            
-            image_url_for_preview = url_for('send_uploaded_file', filename=filename)
-            
-            # Consider deleting filepath if it's large and only needed for this request processing
-            # For hackathon, keeping it for send_uploaded_file is simpler.
-            # if os.path.exists(filepath):
-            #    os.remove(filepath) # If you were to delete it
+        return None, (jsonify({"error": "No file selected or filename is empty"}), 400)
 
-            return jsonify({
-                "message": "Image processed successfully", 
-                "filename_server_temp": filename, # The unique name on server
-                "image_preview_url": image_url_for_preview, 
-                "recommendations": recs_json_safe,
-                "openai_description": openai_desc, 
-                "gemini_refinement": gemini_refine
-            })
-        except Exception as e:
-            current_app.logger.error(f"Error processing uploaded image route: {e}", exc_info=True)
-            if 'filepath' in locals() and os.path.exists(filepath): # Check if filepath was defined
-                try: 
-                    os.remove(filepath)
-                    current_app.logger.info(f"Cleaned up errored upload: {filepath}")
-                except Exception as e_rem: 
-                    current_app.logger.error(f"Failed to remove temp file {filepath} on error: {e_rem}")
-            return jsonify({"error": f"Server error processing image: {str(e)}"}), 500
-    else: # This 'else' corresponds to `if allowed_file(file.filename):`
+    if not allowed_file(file.filename):
         current_ext = "unknown"
-        file_name_log = file.filename # `file` is defined here
+        file_name_log = file.filename
         
         if '.' in file.filename: 
             current_ext = file.filename.rsplit('.', 1)[1].lower()
         
         allowed_ext_config = app.config.get('ALLOWED_EXTENSIONS', {'png', 'jpg', 'jpeg', 'gif'})
         current_app.logger.warning(f"File type not allowed: {file_name_log} (extension: {current_ext}). Allowed: {', '.join(allowed_ext_config)}")
-        return jsonify({"error": f"File type '{current_ext}' not allowed. Please upload one of: {', '.join(allowed_ext_config)}."}), 400
+        return None, (jsonify({"error": f"File type '{current_ext}' not allowed. Please upload one of: {', '.join(allowed_ext_config)}."}), 400)
+
+    filename = secure_filename(f"{uuid.uuid4()}_{file.filename}")
+    try:
+        query_image = QueryImage.from_file_storage(file, filename)
+    except Exception as e:
+        current_app.logger.warning(f"Could not decode uploaded image {file.filename}: {e}")
+        return None, (jsonify({"error": "The uploaded file could not be read as an image."}), 400)
+    if PERSIST_UPLOADS:
+        filepath = query_image.persist(os.path.join(current_app.root_path, app.config['UPLOAD_FOLDER']))
+        current_app.logger.info(f"Uploaded image saved to: {filepath}")
+    return query_image, None
+
+def upload_preview_url(query_image):
+    return url_for('send_uploaded_file', filename=query_image.filename) if query_image.filepath else None
+
+def remove_errored_upload(query_image):
+    filepath = query_image.filepath if query_image else None
+    if filepath and os.path.exists(filepath):
+        try: 
+            os.remove(filepath)
+            current_app.logger.info(f"Cleaned up errored upload: {filepath}")
+        except Exception as e_rem: 
+            current_app.logger.error(f"Failed to remove temp file {filepath} on error: {e_rem}")
+
+@app.route('/upload_image', methods=['POST'])
+def upload_image_route():
+    not_ready_response = recommendations_not_ready_response()
+    if not_ready_response: return not_ready_response
+    query_image = None
+    try:
+        query_image, error_response = read_uploaded_image()
+        if error_response: return error_response
+        prompt_text = request.form.get('prompt', '')
+        user_for_prefs = current_user if current_user.is_authenticated else None
+        
+        recs_json_safe, openai_desc, gemini_refine = generate_final_recommendations(
+            query_image=query_image, text_prompt=prompt_text, user_for_prefs=user_for_prefs
+        )
+
+        return jsonify({
+            "message": "Image processed successfully", 
+            "filename_server_temp": query_image.filename, # The unique name on server
+            "image_preview_url": upload_preview_url(query_image), # None unless PERSIST_UPLOADS; the client previews locally 
+            "recommendations": recs_json_safe,
+            "openai_description": openai_desc, 
+            "gemini_refinement": gemini_refine
+        })
+    except Exception as e:
+        current_app.logger.error(f"Error processing uploaded image route: {e}", exc_info=True)
+        remove_errored_upload(query_image)
+        return jsonify({"error": f"Server error processing image: {str(e)}"}), 500
+
+@app.route('/upload_image_stream', methods=['POST'])
+def upload_image_stream_route():
+    """
+    Streaming variant of /upload_image. Responds with NDJSON, one event per line, as stages finish:
+    "upload" (preview URL), "visual" (ViT top-k), "description" (OpenAI), then "final" (Gemini-reranked list),
+    or "error".
+    """
+    not_ready_response = recommendations_not_ready_response()
+    if not_ready_response: return not_ready_response
+    try:
+        query_image, error_response = read_uploaded_image()
+    except Exception as e:
+        current_app.logger.error(f"Error saving uploaded image for streaming route: {e}", exc_info=True)
+        return jsonify({"error": f"Server error processing image: {str(e)}"}), 500
+    if error_response: return error_response
+
+    prompt_text = request.form.get('prompt', '')
+    user_preferences = current_user.get_preferences() if current_user.is_authenticated else {}
+    filename = query_image.filename
+    image_url_for_preview = upload_preview_url(query_image)
+    top_k = 10
+    catalog_snapshot = get_catalog_snapshot() # Pinned for the whole stream, even if the catalog reloads mid-request
+
+    def ndjson_event(event_name, **payload):
+        return json.dumps({"event": event_name, **payload}) + "\n"
+
+    def generate_events():
+        yield ndjson_event("upload", filename_server_temp=filename, image_preview_url=image_url_for_preview)
+        try:
+            stage_results = {}
+            for stage_name, result in build_recommendation_pipeline(query_image, prompt_text, top_k, catalog_snapshot).iter_results():
+                stage_results[stage_name] = result
+                if stage_name == "visual_search" and result:
+                    visual_ranked = []
+                    boosts = catalog_snapshot.preference_scores([p.get("id") for p in result], user_preferences)
+                    for product, boost in zip(result, boosts.tolist()):
+                        ranked = product.copy()
+                        ranked["final_score"] = ranked.get("visual_score", 0.0) * 10.0 + boost
+                        visual_ranked.append(ranked)
+                    visual_ranked.sort(key=lambda x: x["final_score"], reverse=True)
+                    yield ndjson_event("visual", recommendations=finalize_recommendations(visual_ranked, top_k))
+                elif stage_name == "openai_description":
+                    yield ndjson_event("description", openai_description=result)
+
+            scored_recommendations, openai_desc, gemini_refine = score_recommendation_candidates(
+                query_image=query_image, text_prompt=prompt_text, top_k=top_k,
+                user_preferences=user_preferences, stage_results=stage_results, catalog_snapshot=catalog_snapshot
+            )
+            yield ndjson_event("final", message="Image processed successfully", filename_server_temp=filename,
+                               image_preview_url=image_url_for_preview,
+                               recommendations=finalize_recommendations(scored_recommendations, top_k),
+                               openai_description=openai_desc, gemini_refinement=gemini_refine)
+        except Exception as e:
+            current_app.logger.error(f"Error processing streamed image upload: {e}", exc_info=True)
+            remove_errored_upload(query_image)
+            yield ndjson_event("error", error=f"Server error processing image: {str(e)}")
+
+    # X-Accel-Buffering stops nginx-style proxies from holding events until the response ends
+    return Response(stream_with_context(generate_events()), mimetype="application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.route(f"/{app.config['UPLOAD_FOLDER']}/<path:filename>")
@@ -296,6 +538,8 @@ def send_uploaded_file(filename):
 
 @app.route('/get_recommendations', methods=['POST'])
 def get_recommendations_route():
+    not_ready_response = recommendations_not_ready_response()
+    if not_ready_response: return not_ready_response
     user_for_prefs = current_user if current_user.is_authenticated else None
     data = request.json
     prompt_text = data.get('prompt', '')
@@ -308,6 +552,47 @@ def get_recommendations_route():
         current_app.logger.error(f"Error getting text recommendations: {e}", exc_info=True)
         return jsonify({"error": "Failed to get recommendations"}), 500
 
+@app.route('/healthz')
+def healthz_route():
+    """Liveness: the process is up and serving requests (models may still be loading)."""
+    return jsonify({"status": "ok"}), 200
+
+@app.route('/readyz')
+def readyz_route():
+    """Readiness: 200 once the warm-up has loaded the catalog and models, 503 (with per-step state) until then."""
+    status = warm_up.get_status()
+    return jsonify(status), 200 if status["ready"] else 503
+
+def is_admin_request():
+    """True if the request carries the X-Admin-Token matching ADMIN_API_TOKEN (never when the token is unset)."""
+    supplied_token = request.headers.get("X-Admin-Token", "")
+    return bool(ADMIN_API_TOKEN) and hmac.compare_digest(supplied_token.encode(), ADMIN_API_TOKEN.encode())
+
+@app.route('/api/metrics')
+def metrics_api_route():
+    if not is_admin_request():
+        return jsonify({"error": "Not authorized"}), 403
+    return jsonify({
+        "gemini_cache": get_gemini_cache_stats(),
+        "spacy_cache": get_spacy_cache_stats(),
+        "image_analysis_cache": image_analysis_cache.get_stats(),
+        "pipeline_stages": get_pipeline_stats(),
+        "vit_batching": get_vit_batching_stats(),
+        "db": db.get_pool_stats(),
+        "catalog": get_catalog_snapshot().describe(),
+    }), 200
+
+@app.route('/api/admin/reload_catalog', methods=['POST'])
+def reload_catalog_api_route():
+    if not is_admin_request():
+        return jsonify({"error": "Not authorized"}), 403
+    try:
+        summary = reload_catalog()
+    except Exception as e:
+        current_app.logger.error(f"Catalog reload failed: {e}", exc_info=True)
+        return jsonify({"error": "Catalog reload failed."}), 500
+    return jsonify(summary), 500 if "error" in summary else 200
+
 # --- Authentication Routes ---
 @app.route('/api/signup', methods=['POST'])
 def signup_api_route():
@@ -333,8 +618,9 @@ def signup_api_route():
         )
         database.commit()
         user_id = cursor.lastrowid
+        User.invalidate_cached(user_id)
         
-        cursor.execute("INSERT INTO user_preferences (user_id, preferences_json) VALUES (?, ?)", (user_id, json.dumps({})))
+        cursor.execute("INSERT INTO user_preferences (user_id) VALUES (?)", (user_id,))
         database.commit()
 
         new_user_obj = User.get_by_id(str(user_id))
@@ -384,17 +670,14 @@ def current_user_status_api_route():
     return jsonify({"logged_in": False}), 200
 
 # --- User Data API Routes ---
+def product_details_for_client(product):
+    product_detail = product.copy()
+    product_detail.pop('visual_score', None)
+    return product_detail
+
 def get_full_product_details_for_user_list(product_ids_list):
     if not product_ids_list: return []
-    all_catalog_products = get_catalog_products()
-    details = []
-    for prod_id_str in product_ids_list:
-        product_detail = next((p.copy() for p in all_catalog_products if str(p['id']) == str(prod_id_str)), None)
-        if product_detail:
-            if 'embedding' in product_detail: del product_detail['embedding']
-            if 'visual_score' in product_detail: del product_detail['visual_score']
-            details.append(product_detail)
-    return details
+    return [product_details_for_client(p) for p in get_products_by_ids(product_ids_list) if p is not None]
 
 @app.route('/api/wishlist', methods=['GET', 'POST', 'DELETE'])
 @login_required
@@ -427,12 +710,10 @@ def cart_api_route():
     if request.method == 'GET':
         cart_items_data = user_obj.get_cart_items()
         detailed_cart = []
-        all_catalog_products = get_catalog_products()
-        for item_data in cart_items_data:
-            product_detail = next((p.copy() for p in all_catalog_products if str(p['id']) == str(item_data['product_id'])), None)
-            if product_detail:
-                if 'embedding' in product_detail: del product_detail['embedding']
-                if 'visual_score' in product_detail: del product_detail['visual_score']
+        cart_products = get_products_by_ids([item_data['product_id'] for item_data in cart_items_data])
+        for item_data, product in zip(cart_items_data, cart_products):
+            if product:
+                product_detail = product_details_for_client(product)
                 product_detail['quantity'] = item_data['quantity']
                 detailed_cart.append(product_detail)
         return jsonify({"cart": detailed_cart}), 200
@@ -449,6 +730,62 @@ def cart_api_route():
             return jsonify({"message": "Removed from cart", "cart_items_data": user_obj.get_cart_items()}), 200
     return jsonify({"error": "Operation failed"}), 500
 
+# --- Batch Cart/Wishlist Mutations (one transaction and one response per batch) ---
+MAX_BATCH_OPERATIONS = 200
+
+def parse_batch_operations(data, with_quantity):
+    """
+    Reads {"operations": [{"productId": ..., "quantity": ...}, ...]} from a request body.
+    Returns ([(product_id, quantity)] or [product_id], None) or (None, error response).
+    """
+    operations = (data or {}).get("operations")
+    if not isinstance(operations, list) or not operations:
+        return None, (jsonify({"error": "operations must be a non-empty list"}), 400)
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return None, (jsonify({"error": f"At most {MAX_BATCH_OPERATIONS} operations per batch"}), 400)
+    parsed = []
+    for position, operation in enumerate(operations):
+        product_id = operation.get("productId") if isinstance(operation, dict) else None
+        if product_id is None or str(product_id) == "":
+            return None, (jsonify({"error": f"operations[{position}]: productId required"}), 400)
+        if not with_quantity:
+            parsed.append(str(product_id))
+            continue
+        quantity = operation.get("quantity", 1)
+        if not isinstance(quantity, int) or isinstance(quantity, bool):
+            return None, (jsonify({"error": f"operations[{position}]: quantity must be an integer"}), 400)
+        parsed.append((str(product_id), quantity))
+    return parsed, None
+
+@app.route('/api/wishlist/batch', methods=['POST', 'DELETE'])
+@login_required
+def wishlist_batch_api_route():
+    user_obj = User.get_by_id(current_user.id)
+    if not user_obj: return jsonify({"error": "User not found"}), 404
+    product_ids, error_response = parse_batch_operations(request.get_json(silent=True), with_quantity=False)
+    if error_response: return error_response
+
+    if request.method == 'POST' and user_obj.add_many_to_wishlist_db(product_ids):
+        return jsonify({"message": f"Added {len(product_ids)} items to wishlist", "wishlist_ids": user_obj.get_wishlist_ids()}), 200
+    if request.method == 'DELETE' and user_obj.remove_many_from_wishlist_db(product_ids):
+        return jsonify({"message": f"Removed {len(product_ids)} items from wishlist", "wishlist_ids": user_obj.get_wishlist_ids()}), 200
+    return jsonify({"error": "Operation failed"}), 500
+
+@app.route('/api/cart/batch', methods=['POST', 'DELETE'])
+@login_required
+def cart_batch_api_route():
+    """POST applies quantity deltas (as /api/cart POST does per item); DELETE removes whole items (quantity ignored)."""
+    user_obj = User.get_by_id(current_user.id)
+    if not user_obj: return jsonify({"error": "User not found"}), 404
+    changes, error_response = parse_batch_operations(request.get_json(silent=True), with_quantity=request.method == 'POST')
+    if error_response: return error_response
+
+    if request.method == 'POST' and user_obj.apply_cart_changes_db(changes):
+        return jsonify({"message": "Cart updated", "cart_items_data": user_obj.get_cart_items()}), 200
+    if request.method == 'DELETE' and user_obj.remove_many_from_cart_db(changes):
+        return jsonify({"message": "Removed from cart", "cart_items_data": user_obj.get_cart_items()}), 200
+    return jsonify({"error": "Operation failed"}), 500
+
 @app.route('/api/preferences/update', methods=['POST'])
 @login_required
 def update_preferences_api_route():
@@ -456,24 +793,13 @@ def update_preferences_api_route():
     if not action or value is None: return jsonify({"error": "Action and value required"}), 400
     user_obj = User.get_by_id(current_user.id)
     if not user_obj: return jsonify({"error": "User not found"}), 404
-    current_preferences = user_obj.get_preferences()
-
-    if action == "liked_color" and isinstance(value, str):
-        color = value.lower(); current_preferences.setdefault("liked_colors", {})
-        current_preferences["liked_colors"][color] = current_preferences["liked_colors"].get(color, 0) + 1
-    elif action == "interacted_category" and isinstance(value, str):
-        category = value; current_preferences.setdefault("interacted_categories", [])
-        if category not in current_preferences["interacted_categories"]: current_preferences["interacted_categories"].append(category)
-        current_preferences["interacted_categories"] = current_preferences["interacted_categories"][-10:]
-    elif action == "search_keywords" and isinstance(value, list):
-        current_preferences.setdefault("recent_keywords", [])
-        for kw in reversed(value): 
-            if kw not in current_preferences["recent_keywords"]: current_preferences["recent_keywords"].insert(0, kw)
-        current_preferences["recent_keywords"] = current_preferences["recent_keywords"][:10]
-    else: return jsonify({"error": "Invalid preference action"}), 400
-
-    if user_obj.save_preferences(current_preferences):
-        return jsonify({"message": "Preferences updated", "preferences": current_preferences}), 200
+
+    valid_value = {"liked_color": str, "interacted_category": str, "search_keywords": list}.get(action)
+    if valid_value is None or not isinstance(value, valid_value): return jsonify({"error": "Invalid preference action"}), 400
+
+    updated = user_obj.record_preference_db(action, value)
+    if updated is not None:
+        return jsonify({"message": "Preferences updated", "preferences": updated[1]}), 200
     return jsonify({"error": "Failed to update preferences"}), 500
 
 @app.route('/api/mock_checkout_process', methods=['POST'])
@@ -485,10 +811,9 @@ def mock_checkout_process_route():
     current_cart_items_data = user_obj.get_cart_items()
     if not current_cart_items_data: return jsonify({"error": "Cart is empty"}), 400
 
-    cart_product_details = get_full_product_details_for_user_list([item['product_id'] for item in current_cart_items_data])
+    cart_products = get_products_by_ids([item['product_id'] for item in current_cart_items_data])
     total_price = 0; order_items_summary = []
-    for cart_item_spec in current_cart_items_data:
-        product_detail = next((p for p in cart_product_details if str(p['id']) == str(cart_item_spec['product_id'])), None)
+    for cart_item_spec, product_detail in zip(current_cart_items_data, cart_products):
         if product_detail:
             try:
                 price_val = float(str(product_detail.get('price', '0')).replace('$', ''))
@@ -524,5 +849,50 @@ def mock_checkout_process_route():
         current_app.logger.error(f"Checkout DB error: {e}")
         return jsonify({"error": "Order placement failed."}), 500
 
+# --- Warm-up: AI clients, models, catalog and homepage cache ---
+# Runs on a background thread by default, so auth, cart and wishlist routes are served right after import
+# while the AI routes answer 503 until /readyz turns ready. WARM_UP_MODE=eager loads everything inline;
+# WARM_UP_MODE=preload does too, for servers that import the app once and fork workers from it.
+def init_ai_clients():
+    global openai_client
+    configured = True
+    if not OPENAI_API_KEY: current_app.logger.warning("OPENAI_API_KEY missing."); configured = False
+    else:
+        try:
+            import openai as openai_sdk
+            openai_client = openai_sdk.OpenAI(api_key=OPENAI_API_KEY); current_app.logger.info("OpenAI client OK.")
+        except Exception as e: current_app.logger.error(f"OpenAI client init error: {e}"); openai_client = None; configured = False
+    
+    if not GOOGLE_API_KEY: current_app.logger.warning("GOOGLE_API_KEY missing."); configured = False
+    else:
+        try:
+            import google.generativeai as genai
+            genai.configure(api_key=GOOGLE_API_KEY); current_app.logger.info("Gemini configured OK.")
+        except Exception as e: current_app.logger.error(f"Gemini config error: {e}"); configured = False
+    return configured
+
+def warm_up_catalog():
+    summary = load_and_preprocess_catalog()
+    if "error" in summary:
+        raise RuntimeError(summary["error"])
+
+def start_background_tasks(flask_app):
+    """
+    Starts the upload reaper, homepage refresher and catalog watcher threads. Threads do not survive fork(),
+    so with WARM_UP_MODE=preload the server calls this in every worker after forking (see gunicorn.conf.py).
+    """
+    if PERSIST_UPLOADS: start_upload_reaper(flask_app, upload_folder_path)
+    start_homepage_refresher(flask_app) # Started before the first build so the schedule survives a failed one
+    if CATALOG_WATCH_INTERVAL_SECONDS > 0: start_catalog_watcher(flask_app)
+
+warm_up = WarmUp()
+warm_up.add("ai_clients", init_ai_clients)
+warm_up.add("spacy", lambda: load_spacy_model() is not None) # Before the catalog, which lemmatizes product text
+warm_up.add("catalog", warm_up_catalog, required=True, retries=CATALOG_WARM_UP_RETRIES) # Embeds only cache misses, loading ViT if it needs to
+warm_up.add("vit", lambda: load_vit_model()[1] is not None)
+warm_up.add("homepage", refresh_homepage_recommendations)
+if WARM_UP_MODE != "preload": start_background_tasks(app)
+warm_up.start(app, background=WARM_UP_MODE not in ("eager", "preload"))
+
 if __name__ == '__main__':
     app.run(debug=True, use_reloader=False)
\ No newline at end of file
@@ -1,23 +1,182 @@
 # backend_flask/db.py
 import sqlite3
 import os
+import json
+import queue
+import threading
+import time
 from flask import current_app, g
 
 DATABASE_FILENAME = 'shopsmarter.sqlite3' # Name of your SQLite database file
 
+# Connection pool: connections are opened and configured once, then checked out per app context
+# and returned on teardown. DB_POOL_SIZE caps idle connections kept; bursts above it open extra ones.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256")) # Prepared statements kept per connection
+DB_SLOW_WRITE_MS = float(os.getenv("DB_SLOW_WRITE_MS", "50")) # Writes slower than this almost always waited on another writer's lock
+
+_pool_stats = {"opened": 0, "reused": 0, "checkouts": 0, "in_use": 0, "peak_in_use": 0, "discarded": 0}
+_lock_stats = {"busy_errors": 0, "slow_writes": 0, "slow_write_ms": 0.0, "max_write_ms": 0.0}
+_stats_lock = threading.Lock()
+
+def _record_write(elapsed_ms):
+    with _stats_lock:
+        _lock_stats["max_write_ms"] = max(_lock_stats["max_write_ms"], elapsed_ms)
+        if elapsed_ms >= DB_SLOW_WRITE_MS:
+            _lock_stats["slow_writes"] += 1
+            _lock_stats["slow_write_ms"] += elapsed_ms
+
+def _record_busy_error(e):
+    message = str(e).lower()
+    if "locked" in message or "busy" in message:
+        with _stats_lock:
+            _lock_stats["busy_errors"] += 1
+
+
+class PooledCursor(sqlite3.Cursor):
+    """Cursor that times writes so lock contention shows up in get_pool_stats()."""
+
+    def _timed(self, method, sql, parameters):
+        if sql.lstrip()[:6].upper() == "SELECT":
+            return method(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return method(sql, parameters)
+        except sqlite3.OperationalError as e:
+            _record_busy_error(e)
+            raise
+        finally:
+            _record_write(1000.0 * (time.perf_counter() - start))
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+
+class PooledConnection(sqlite3.Connection):
+    def cursor(self, factory=PooledCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            super().commit()
+        except sqlite3.OperationalError as e:
+            _record_busy_error(e)
+            raise
+        finally:
+            _record_write(1000.0 * (time.perf_counter() - start))
+
+
+class ConnectionPool:
+    """Thread-safe pool of configured SQLite connections to one database file."""
+
+    def __init__(self, db_path, size=DB_POOL_SIZE):
+        self.db_path = db_path
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size) # LIFO keeps the warmest connections in use
+
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000.0,
+            cached_statements=DB_STATEMENT_CACHE_SIZE,
+            check_same_thread=False, # Checked out by one thread at a time, but not always the one that opened it
+            factory=PooledConnection,
+        )
+        conn.row_factory = sqlite3.Row # Access columns by name
+        conn.execute("PRAGMA journal_mode=WAL") # Readers no longer block on (or block) cart/wishlist writes
+        conn.execute("PRAGMA synchronous=NORMAL") # Safe with WAL; skips the fsync on every commit
+        conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def acquire(self):
+        try:
+            conn = self._idle.get_nowait()
+            reused = True
+        except queue.Empty:
+            conn = self._connect()
+            reused = False
+        with _stats_lock:
+            _pool_stats["checkouts"] += 1
+            _pool_stats["reused" if reused else "opened"] += 1
+            _pool_stats["in_use"] += 1
+            _pool_stats["peak_in_use"] = max(_pool_stats["peak_in_use"], _pool_stats["in_use"])
+        return conn
+
+    def release(self, conn):
+        with _stats_lock:
+            _pool_stats["in_use"] -= 1
+        try:
+            if conn.in_transaction: # Uncommitted work is discarded, as closing the connection did before
+                conn.rollback()
+            self._idle.put_nowait(conn)
+        except (sqlite3.Error, queue.Full):
+            with _stats_lock:
+                _pool_stats["discarded"] += 1
+            conn.close()
+
+    def close_all(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def idle_count(self):
+        return self._idle.qsize()
+
+
+_pools = {} # db path -> ConnectionPool
+_pools_lock = threading.Lock()
+
+def _get_pool(db_path):
+    pool = _pools.get(db_path)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(db_path, ConnectionPool(db_path))
+    return pool
+
+def _reset_pools_after_fork():
+    # SQLite connections must not be shared across processes; children start with empty pools.
+    # Locks are replaced too, in case another thread held one at fork time.
+    global _pools_lock, _stats_lock
+    _pools.clear()
+    _pools_lock, _stats_lock = threading.Lock(), threading.Lock()
+    _pool_stats.update({key: 0 for key in _pool_stats})
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_pools_after_fork)
+
+def get_pool_stats():
+    with _stats_lock:
+        stats = {"pool": dict(_pool_stats), "locks": dict(_lock_stats)}
+    stats["pool"]["idle"] = sum(pool.idle_count() for pool in list(_pools.values()))
+    stats["pool"]["max_idle"] = DB_POOL_SIZE
+    return stats
+
 def get_db_path():
     return os.path.join(current_app.root_path, DATABASE_FILENAME)
 
 def get_db():
     if 'db' not in g:
         try:
-            db_path = get_db_path()
-            g.db = sqlite3.connect(
-                db_path,
-                detect_types=sqlite3.PARSE_DECLTYPES
-            )
-            g.db.row_factory = sqlite3.Row # Access columns by name
-            current_app.logger.info(f"SQLite connection successful to: {db_path}")
+            g.db = _get_pool(get_db_path()).acquire()
         except sqlite3.Error as e:
             current_app.logger.error(f"Failed to connect to SQLite: {e}")
             g.db = None
@@ -26,8 +185,7 @@ def get_db():
 def close_db(e=None):
     db_conn = g.pop('db', None)
     if db_conn is not None:
-        db_conn.close()
-        current_app.logger.info("SQLite connection closed.")
+        _get_pool(get_db_path()).release(db_conn)
 
 def init_db_command_logic():
     """Clear existing data and create new tables."""
@@ -48,6 +206,89 @@ def init_db_command_logic():
         current_app.logger.error(f"Error executing schema for SQLite: {e}")
 
 
+# --- Schema migrations for databases created from an older schema.sql ---
+SCHEMA_VERSION = 3 # Must match the PRAGMA user_version at the end of schema.sql
+
+def _migrate_to_v2(db_conn):
+    """UNIQUE (user_id, product_id) on user_cart (merging duplicate rows), drop-at-zero triggers, per-user indexes."""
+    db_conn.execute("""
+        CREATE TABLE user_cart_v2 (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            product_id TEXT NOT NULL,
+            quantity INTEGER DEFAULT 1,
+            added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            UNIQUE (user_id, product_id)
+        )""")
+    db_conn.execute("""
+        INSERT INTO user_cart_v2 (user_id, product_id, quantity, added_at)
+        SELECT user_id, product_id, SUM(COALESCE(quantity, 1)), MIN(added_at) FROM user_cart
+        GROUP BY user_id, product_id HAVING SUM(COALESCE(quantity, 1)) > 0""")
+    db_conn.execute("DROP TABLE user_cart")
+    db_conn.execute("ALTER TABLE user_cart_v2 RENAME TO user_cart")
+    for event in ("INSERT", "UPDATE OF quantity"):
+        trigger_name = "trg_user_cart_drop_empty_" + event.split()[0].lower()
+        db_conn.execute(f"""
+            CREATE TRIGGER {trigger_name} AFTER {event} ON user_cart WHEN NEW.quantity <= 0
+            BEGIN
+                DELETE FROM user_cart WHERE id = NEW.id;
+            END""")
+    db_conn.execute("CREATE INDEX IF NOT EXISTS idx_user_cart_user_items ON user_cart (user_id, product_id, quantity)")
+    db_conn.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_created ON orders (user_id, created_at)")
+
+def _migrate_to_v3(db_conn):
+    """Moves preferences_json blobs into the normalized counter tables and adds user_preferences.version."""
+    db_conn.execute("ALTER TABLE user_preferences ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    db_conn.execute("""
+        CREATE TABLE user_color_prefs (
+            user_id INTEGER NOT NULL, color TEXT NOT NULL, like_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, color), FOREIGN KEY (user_id) REFERENCES users (id)
+        ) WITHOUT ROWID""")
+    for table, column in (("user_category_prefs", "category"), ("user_keyword_prefs", "keyword")):
+        db_conn.execute(f"""
+            CREATE TABLE {table} (
+                user_id INTEGER NOT NULL, {column} TEXT NOT NULL, last_seen INTEGER NOT NULL,
+                PRIMARY KEY (user_id, {column}), FOREIGN KEY (user_id) REFERENCES users (id)
+            ) WITHOUT ROWID""")
+
+    rows = db_conn.execute("SELECT user_id, preferences_json FROM user_preferences WHERE preferences_json IS NOT NULL").fetchall()
+    for row in rows:
+        user_id = row["user_id"]
+        try:
+            prefs = json.loads(row["preferences_json"]) or {}
+            color_rows = [(user_id, str(color).lower(), int(count)) for color, count in prefs.get("liked_colors", {}).items()]
+        except (ValueError, TypeError, AttributeError):
+            current_app.logger.warning(f"Skipping unreadable preferences_json for user {user_id} during migration.")
+            continue
+        db_conn.executemany("INSERT OR REPLACE INTO user_color_prefs (user_id, color, like_count) VALUES (?, ?, ?)", color_rows)
+        categories = prefs.get("interacted_categories", []) # Oldest first
+        db_conn.executemany("INSERT OR REPLACE INTO user_category_prefs (user_id, category, last_seen) VALUES (?, ?, ?)",
+                            [(user_id, category, seq + 1) for seq, category in enumerate(categories)])
+        keywords = prefs.get("recent_keywords", []) # Newest first
+        db_conn.executemany("INSERT OR REPLACE INTO user_keyword_prefs (user_id, keyword, last_seen) VALUES (?, ?, ?)",
+                            [(user_id, keyword, len(keywords) - seq) for seq, keyword in enumerate(keywords)])
+        db_conn.execute("UPDATE user_preferences SET version = ? WHERE user_id = ?", (max(len(categories), len(keywords)) + 1, user_id))
+
+MIGRATIONS = {2: _migrate_to_v2, 3: _migrate_to_v3} # target version -> function; databases from the original schema report version 0
+
+def migrate_db(db_conn):
+    """Applies pending migrations, each in its own transaction, and records the new PRAGMA user_version."""
+    current_version = db_conn.execute("PRAGMA user_version").fetchone()[0]
+    for version in range(current_version + 1, SCHEMA_VERSION + 1):
+        migration = MIGRATIONS.get(version)
+        try:
+            db_conn.execute("BEGIN IMMEDIATE")
+            if migration: migration(db_conn)
+            db_conn.execute(f"PRAGMA user_version = {version}")
+            db_conn.commit()
+            current_app.logger.info(f"Migrated SQLite schema to version {version}.")
+        except sqlite3.Error as e:
+            db_conn.rollback()
+            current_app.logger.error(f"SQLite migration to version {version} failed: {e}")
+            return
+
+
 # Command to initialize the database (run once or when schema changes)
 # Can be triggered via Flask CLI: flask init-db
 def init_db_command():
@@ -76,4 +317,6 @@ def init_app(app):
                 if not cursor.fetchone():
                     current_app.logger.info("Users table not found. Re-initializing schema.")
                     init_db_command_logic()
+                else:
+                    migrate_db(conn)
                 close_db() # Close this specific connection
\ No newline at end of file
@@ -1,8 +1,22 @@
 # backend_flask/models.py
 from flask_login import UserMixin
-from flask import current_app
-import json # For preferences JSON
+from flask import current_app, g
+import sqlite3
+import os
 from . import db # Import the db module we created
+from .ai_core.cache import TTLCache
+
+# Preferences are read on every recommendation call. Updates made by this process refresh the cache
+# immediately; the TTL bounds how long another worker's update can go unseen.
+PREFERENCES_CACHE_TTL_SECONDS = int(os.getenv("PREFERENCES_CACHE_TTL_SECONDS", "30"))
+MAX_RECENT_CATEGORIES = 10
+MAX_RECENT_KEYWORDS = 10
+preferences_cache = TTLCache(max_entries=4096, ttl_seconds=PREFERENCES_CACHE_TTL_SECONDS) # user id -> (version, preferences)
+
+# User rows change only on signup (no profile editing yet), so they are cached across requests for a short TTL.
+# Within a request, the identity map in g hands every caller (Flask-Login's user_loader, then the route) the same User.
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+user_row_cache = TTLCache(max_entries=4096, ttl_seconds=USER_CACHE_TTL_SECONDS) # user id -> column dict
 
 class User(UserMixin):
     def __init__(self, username, id=None, email=None, password_hash=None):
@@ -16,6 +30,29 @@ class User(UserMixin):
     def get_id(self):
         return str(self.id) # Flask-Login expects string ID
 
+    @staticmethod
+    def _identity_map():
+        if 'user_identity_map' not in g:
+            g.user_identity_map = {}
+        return g.user_identity_map
+
+    @staticmethod
+    def _from_row(user_data):
+        user = User(id=user_data["id"], username=user_data["username"],
+                    email=user_data["email"], password_hash=user_data["password_hash"])
+        User._identity_map()[user.id] = user
+        return user
+
+    @staticmethod
+    def invalidate_cached(user_id):
+        """Drops a user from the cross-request cache and this request's identity map; call after changing the users row."""
+        try:
+            user_id_int = int(user_id)
+        except (TypeError, ValueError):
+            return
+        user_row_cache.delete(user_id_int)
+        User._identity_map().pop(user_id_int, None)
+
     @staticmethod
     def get_by_username(username_val):
         database = db.get_db()
@@ -25,50 +62,122 @@ class User(UserMixin):
         user_data = cursor.fetchone()
         if user_data:
             # sqlite3.Row allows access by column name
-            return User(id=user_data["id"], username=user_data["username"], 
-                        email=user_data["email"], password_hash=user_data["password_hash"])
+            return User._from_row(user_data)
         return None
 
     @staticmethod
     def get_by_id(user_id):
-        database = db.get_db()
-        if not database: return None
         try:
             # Flask-Login passes ID as string, convert to int for SQLite
             user_id_int = int(user_id)
+        except (TypeError, ValueError): # If user_id cannot be converted to int
+            current_app.logger.warning(f"Invalid user_id format for get_by_id: {user_id}")
+            return None
+        user = User._identity_map().get(user_id_int)
+        if user is not None:
+            return user
+        cached_row = user_row_cache.get(user_id_int)
+        if cached_row is not None:
+            return User._from_row(cached_row)
+
+        database = db.get_db()
+        if not database: return None
+        try:
             cursor = database.cursor()
-            cursor.execute("SELECT * FROM users WHERE id = ?", (user_id_int,))
+            cursor.execute("SELECT id, username, email, password_hash FROM users WHERE id = ?", (user_id_int,))
             user_data = cursor.fetchone()
             if user_data:
-                return User(id=user_data["id"], username=user_data["username"], 
-                            email=user_data["email"], password_hash=user_data["password_hash"])
-        except ValueError: # If user_id cannot be converted to int
-            current_app.logger.warning(f"Invalid user_id format for get_by_id: {user_id}")
+                user_row_cache.set(user_id_int, dict(user_data))
+                return User._from_row(user_data)
         except Exception as e:
             current_app.logger.error(f"Error fetching user by ID {user_id}: {e}")
         return None
 
     # --- Methods for user data, using SQLite ---
     def get_preferences(self):
+        """Preference dict for scoring. Shared with the cache, so callers must not mutate it."""
+        return self.get_preferences_versioned()[1]
+
+    def get_preferences_versioned(self):
+        """Returns (version, preferences); the version changes whenever the preferences do."""
+        if not self.id: return 0, {}
+        cached = preferences_cache.get(self.id)
+        if cached is not None: return cached
         database = db.get_db()
-        if not database or not self.id: return {}
-        cursor = database.cursor()
-        cursor.execute("SELECT preferences_json FROM user_preferences WHERE user_id = ?", (self.id,))
-        row = cursor.fetchone()
-        return json.loads(row["preferences_json"]) if row and row["preferences_json"] else {}
+        if not database: return 0, {}
+        entry = self._load_preferences_db(database)
+        preferences_cache.set(self.id, entry)
+        return entry
 
-    def save_preferences(self, prefs_dict):
+    def _load_preferences_db(self, database):
+        row = database.execute("SELECT version FROM user_preferences WHERE user_id = ?", (self.id,)).fetchone()
+        version = row["version"] if row else 0
+        preferences = {}
+        liked_colors = {r["color"]: r["like_count"] for r in database.execute(
+            "SELECT color, like_count FROM user_color_prefs WHERE user_id = ?", (self.id,))}
+        if liked_colors: preferences["liked_colors"] = liked_colors
+        categories = [r["category"] for r in database.execute(
+            "SELECT category FROM user_category_prefs WHERE user_id = ? ORDER BY last_seen", (self.id,))] # Oldest first
+        if categories: preferences["interacted_categories"] = categories
+        keywords = [r["keyword"] for r in database.execute(
+            "SELECT keyword FROM user_keyword_prefs WHERE user_id = ? ORDER BY last_seen DESC", (self.id,))] # Newest first
+        if keywords: preferences["recent_keywords"] = keywords
+        return version, preferences
+
+    def _bump_preferences_version(self, database, steps=1):
+        database.execute("""
+            INSERT INTO user_preferences (user_id, version) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET version = version + excluded.version
+        """, (self.id, steps))
+        return database.execute("SELECT version FROM user_preferences WHERE user_id = ?", (self.id,)).fetchone()["version"]
+
+    def record_preference_db(self, action, value):
+        """
+        Applies one preference event ("liked_color", "interacted_category" or "search_keywords") with
+        atomic SQL increments in a single transaction. Returns the new (version, preferences), or None on failure.
+        """
+        if action not in ("liked_color", "interacted_category", "search_keywords"):
+            raise ValueError(f"Unknown preference action: {action}")
         database = db.get_db()
-        if not database or not self.id: return False
-        prefs_json = json.dumps(prefs_dict)
-        cursor = database.cursor()
-        # UPSERT logic: insert if not exists, update if exists
-        cursor.execute("""
-            INSERT INTO user_preferences (user_id, preferences_json) VALUES (?, ?)
-            ON CONFLICT(user_id) DO UPDATE SET preferences_json = excluded.preferences_json;
-        """, (self.id, prefs_json))
-        database.commit()
-        return True
+        if not database or not self.id: return None
+        try:
+            database.execute("BEGIN IMMEDIATE") # Take the write lock up front so concurrent clicks queue instead of racing
+            if action == "liked_color":
+                self._bump_preferences_version(database)
+                database.execute("""
+                    INSERT INTO user_color_prefs (user_id, color, like_count) VALUES (?, ?, 1)
+                    ON CONFLICT(user_id, color) DO UPDATE SET like_count = like_count + 1
+                """, (self.id, value.lower()))
+            elif action == "interacted_category":
+                version = self._bump_preferences_version(database)
+                database.execute("""
+                    INSERT INTO user_category_prefs (user_id, category, last_seen) VALUES (?, ?, ?)
+                    ON CONFLICT(user_id, category) DO UPDATE SET last_seen = excluded.last_seen
+                """, (self.id, value, version))
+                self._trim_recent_db(database, "user_category_prefs", "category", MAX_RECENT_CATEGORIES)
+            elif action == "search_keywords":
+                keywords = list(dict.fromkeys(kw for kw in value if isinstance(kw, str) and kw))
+                version = self._bump_preferences_version(database, steps=max(1, len(keywords)))
+                # The first keyword in the list is the most recent, as before
+                database.executemany("""
+                    INSERT INTO user_keyword_prefs (user_id, keyword, last_seen) VALUES (?, ?, ?)
+                    ON CONFLICT(user_id, keyword) DO UPDATE SET last_seen = excluded.last_seen
+                """, [(self.id, kw, version - position) for position, kw in enumerate(keywords)])
+                self._trim_recent_db(database, "user_keyword_prefs", "keyword", MAX_RECENT_KEYWORDS)
+            database.commit()
+        except sqlite3.Error as e:
+            database.rollback()
+            current_app.logger.error(f"Error updating preferences ({action}) for user {self.id}: {e}")
+            return None
+        entry = self._load_preferences_db(database)
+        preferences_cache.set(self.id, entry)
+        return entry
+
+    def _trim_recent_db(self, database, table, column, keep):
+        database.execute(f"""
+            DELETE FROM {table} WHERE user_id = ? AND {column} NOT IN (
+                SELECT {column} FROM {table} WHERE user_id = ? ORDER BY last_seen DESC LIMIT ?
+            )""", (self.id, self.id, keep))
 
     def get_wishlist_ids(self):
         database = db.get_db()
@@ -101,6 +210,28 @@ class User(UserMixin):
             current_app.logger.error(f"Error removing from wishlist for user {self.id}, product {product_id}: {e}")
             return False
 
+    def add_many_to_wishlist_db(self, product_ids):
+        """Adds several products in one transaction."""
+        return self._executemany_db("INSERT OR IGNORE INTO user_wishlist (user_id, product_id) VALUES (?, ?)",
+                                    [(self.id, str(pid)) for pid in product_ids], "adding to wishlist")
+
+    def remove_many_from_wishlist_db(self, product_ids):
+        return self._executemany_db("DELETE FROM user_wishlist WHERE user_id = ? AND product_id = ?",
+                                    [(self.id, str(pid)) for pid in product_ids], "removing from wishlist")
+
+    def _executemany_db(self, sql, rows, action):
+        """Runs one statement over `rows` in a single transaction; rolls everything back on error."""
+        database = db.get_db()
+        if not database or not self.id: return False
+        try:
+            database.executemany(sql, rows)
+            database.commit()
+            return True
+        except sqlite3.Error as e:
+            database.rollback()
+            current_app.logger.error(f"Error {action} ({len(rows)} items) for user {self.id}: {e}")
+            return False
+
     def get_cart_items(self): # Returns list of {"product_id": "id", "quantity": int}
         database = db.get_db()
         if not database or not self.id: return []
@@ -113,23 +244,28 @@ class User(UserMixin):
         if not database or not self.id: return False
         try:
             cursor = database.cursor()
-            # Check if item already in cart to update quantity
-            cursor.execute("SELECT quantity FROM user_cart WHERE user_id = ? AND product_id = ?", (self.id, str(product_id)))
-            row = cursor.fetchone()
-            if row: # Item exists, update quantity
-                new_quantity = row["quantity"] + quantity
-                if new_quantity <= 0: # If new quantity is 0 or less, remove item
-                    self.remove_from_cart_db(product_id)
-                else:
-                    cursor.execute("UPDATE user_cart SET quantity = ? WHERE user_id = ? AND product_id = ?", (new_quantity, self.id, str(product_id)))
-            elif quantity > 0 : # Item not in cart, add new
-                cursor.execute("INSERT INTO user_cart (user_id, product_id, quantity) VALUES (?, ?, ?)", (self.id, str(product_id), quantity))
+            # Applies the quantity delta in one statement; the user_cart triggers delete the row if it drops to 0 or below
+            cursor.execute("""
+                INSERT INTO user_cart (user_id, product_id, quantity) VALUES (?, ?, ?)
+                ON CONFLICT(user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+            """, (self.id, str(product_id), quantity))
             database.commit()
             return True
         except sqlite3.Error as e:
             current_app.logger.error(f"Error adding/updating cart for user {self.id}, product {product_id}: {e}")
             return False
 
+    def apply_cart_changes_db(self, changes): # changes: [(product_id, quantity delta), ...]
+        """Batched add_to_cart_db: every delta is applied in one transaction (rows reaching 0 are dropped by trigger)."""
+        return self._executemany_db("""
+                INSERT INTO user_cart (user_id, product_id, quantity) VALUES (?, ?, ?)
+                ON CONFLICT(user_id, product_id) DO UPDATE SET quantity = quantity + excluded.quantity
+            """, [(self.id, str(pid), quantity) for pid, quantity in changes], "updating cart")
+
+    def remove_many_from_cart_db(self, product_ids):
+        return self._executemany_db("DELETE FROM user_cart WHERE user_id = ? AND product_id = ?",
+                                    [(self.id, str(pid)) for pid in product_ids], "removing from cart")
+
     def remove_from_cart_db(self, product_id): # Removes entire item
         database = db.get_db()
         if not database or not self.id: return False
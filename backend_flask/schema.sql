@@ -5,6 +5,9 @@ DROP TABLE IF EXISTS user_wishlist;
 DROP TABLE IF EXISTS user_cart;
 DROP TABLE IF EXISTS user_preferences;
 DROP TABLE IF EXISTS orders; -- For mock checkout
+DROP TABLE IF EXISTS user_color_prefs;
+DROP TABLE IF EXISTS user_category_prefs;
+DROP TABLE IF EXISTS user_keyword_prefs;
 
 CREATE TABLE users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -16,12 +19,36 @@ CREATE TABLE users (
 
 CREATE TABLE user_preferences (
     user_id INTEGER PRIMARY KEY,
-    -- Store preferences as JSON text for flexibility
-    -- e.g., {"liked_colors": {"red": 2, "blue": 1}, "interacted_categories": ["Apparel", "Footwear"]}
-    preferences_json TEXT, 
+    -- Bumped by every preference update; also the sequence number used for recency below
+    version INTEGER NOT NULL DEFAULT 0,
     FOREIGN KEY (user_id) REFERENCES users (id)
 );
 
+-- Preferences are normalized counters so each click is a single atomic increment
+CREATE TABLE user_color_prefs (
+    user_id INTEGER NOT NULL,
+    color TEXT NOT NULL, -- Lowercased
+    like_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (user_id, color),
+    FOREIGN KEY (user_id) REFERENCES users (id)
+) WITHOUT ROWID;
+
+CREATE TABLE user_category_prefs (
+    user_id INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    last_seen INTEGER NOT NULL, -- user_preferences.version at the last interaction
+    PRIMARY KEY (user_id, category),
+    FOREIGN KEY (user_id) REFERENCES users (id)
+) WITHOUT ROWID;
+
+CREATE TABLE user_keyword_prefs (
+    user_id INTEGER NOT NULL,
+    keyword TEXT NOT NULL,
+    last_seen INTEGER NOT NULL,
+    PRIMARY KEY (user_id, keyword),
+    FOREIGN KEY (user_id) REFERENCES users (id)
+) WITHOUT ROWID;
+
 CREATE TABLE user_wishlist (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     user_id INTEGER NOT NULL,
@@ -37,10 +64,22 @@ CREATE TABLE user_cart (
     product_id TEXT NOT NULL,
     quantity INTEGER DEFAULT 1, -- Added quantity
     added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    FOREIGN KEY (user_id) REFERENCES users (id)
-    -- No UNIQUE constraint on (user_id, product_id) if quantity can be updated
+    FOREIGN KEY (user_id) REFERENCES users (id),
+    UNIQUE (user_id, product_id) -- One row per product; quantity changes go through INSERT ... ON CONFLICT DO UPDATE
 );
 
+-- Rows whose quantity drops to zero or below are removed in the same statement that changed them,
+-- so a cart UPSERT with a negative delta never leaves an empty line behind.
+CREATE TRIGGER trg_user_cart_drop_empty_insert AFTER INSERT ON user_cart WHEN NEW.quantity <= 0
+BEGIN
+    DELETE FROM user_cart WHERE id = NEW.id;
+END;
+
+CREATE TRIGGER trg_user_cart_drop_empty_update AFTER UPDATE OF quantity ON user_cart WHEN NEW.quantity <= 0
+BEGIN
+    DELETE FROM user_cart WHERE id = NEW.id;
+END;
+
 CREATE TABLE orders (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     order_str_id TEXT UNIQUE NOT NULL, -- Human-readable string ID
@@ -52,7 +91,10 @@ CREATE TABLE orders (
     FOREIGN KEY (user_id) REFERENCES users (id)
 );
 
--- You can add indexes for performance later
--- CREATE INDEX idx_users_username ON users (username);
--- CREATE INDEX idx_wishlist_user ON user_wishlist (user_id);
--- CREATE INDEX idx_cart_user ON user_cart (user_id);
\ No newline at end of file
+-- The UNIQUE (user_id, product_id) indexes on user_wishlist and user_cart serve the per-user lookups.
+-- Covering index for the cart read (product_id, quantity by user) without touching the table
+CREATE INDEX idx_user_cart_user_items ON user_cart (user_id, product_id, quantity);
+CREATE INDEX idx_orders_user_created ON orders (user_id, created_at);
+
+-- Bump together with db.SCHEMA_VERSION and add a migration there for existing databases
+PRAGMA user_version = 3;
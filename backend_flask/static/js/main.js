@@ -106,6 +106,55 @@ async function fetchApi(endpoint, options = {}) {
     }
 }
 
+// Streams /upload_image_stream (NDJSON, one event per line), showing early results as they arrive.
+// Resolves with the "final" event payload, or null on error.
+async function fetchUploadStream(formData) {
+    showLoading(true);
+    let finalData = null;
+    try {
+        const response = await fetch(`${API_BASE_URL}/upload_image_stream`, { method: 'POST', body: formData });
+        if (!response.ok || !response.body) {
+            const errorData = await response.json().catch(() => ({}));
+            console.error(`API Error (${response.status}) for /upload_image_stream:`, errorData);
+            alert(`Error: ${errorData.error || response.statusText || 'Unknown server error'}`);
+            return null;
+        }
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        const handleEvent = (event) => {
+            if (event.event === 'upload') {
+                if (event.image_preview_url) currentImagePreviewUrl = event.image_preview_url;
+            } else if (event.event === 'visual') {
+                showLoading(false); // First results are on screen; keep inputs usable while Gemini finishes
+                displayRecommendations(event.recommendations, true);
+            } else if (event.event === 'description') {
+                displayAiInsights(event.openai_description, null);
+            } else if (event.event === 'final') {
+                finalData = event;
+            } else if (event.event === 'error') {
+                console.error('Streamed upload error:', event.error);
+                alert(`Error: ${event.error}`);
+            }
+        };
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffered += decoder.decode(value, { stream: true });
+            const lines = buffered.split('\n');
+            buffered = lines.pop();
+            lines.filter(line => line.trim()).forEach(line => handleEvent(JSON.parse(line)));
+        }
+        if (buffered.trim()) handleEvent(JSON.parse(buffered));
+    } catch (error) {
+        console.error('Network/parsing error for /upload_image_stream:', error);
+        alert('Application error. Please check console.');
+    } finally {
+        showLoading(false);
+    }
+    return finalData;
+}
+
 // --- Authentication ---
 function updateUserAuthDisplay() { 
     if (!userAuthSection) return;
@@ -273,7 +322,7 @@ async function fetchAndDisplayRecommendations(prompt = '', imageFileContext = nu
         formData = new FormData();
         formData.append('imageFile', imageFileContext);
         if (currentTextPromptValue) formData.append('prompt', currentTextPromptValue);
-        data = await fetchApi('/upload_image', { method: 'POST', body: formData });
+        data = await fetchUploadStream(formData);
         if (data && data.image_preview_url) currentImagePreviewUrl = data.image_preview_url;
 
     } else if (!isNewImageUpload && currentUploadedFileObject) { // Scenario 2: Refining with prompt, using existing image
@@ -281,7 +330,7 @@ async function fetchAndDisplayRecommendations(prompt = '', imageFileContext = nu
         formData = new FormData();
         formData.append('imageFile', currentUploadedFileObject); // Re-send the current file
         formData.append('prompt', currentTextPromptValue);
-        data = await fetchApi('/upload_image', { method: 'POST', body: formData });
+        data = await fetchUploadStream(formData);
         // Preview URL should remain the same or be updated by backend if it re-serves it
 
     } else { // Scenario 3: Text-only search
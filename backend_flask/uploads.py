@@ -0,0 +1,92 @@
+# backend_flask/uploads.py
+import io
+import os
+import threading
+import time
+from PIL import Image
+from flask import current_app
+
+# Uploaded query images are decoded once in memory. Writing them to UPLOAD_FOLDER is only needed
+# for the server-side preview URL (the frontend already previews the file locally).
+PERSIST_UPLOADS = os.getenv("PERSIST_UPLOADS", "1") != "0"
+UPLOAD_MAX_AGE_SECONDS = int(os.getenv("UPLOAD_MAX_AGE_SECONDS", str(24 * 3600)))
+UPLOAD_MAX_TOTAL_MB = int(os.getenv("UPLOAD_MAX_TOTAL_MB", "500"))
+UPLOAD_REAPER_INTERVAL_SECONDS = int(os.getenv("UPLOAD_REAPER_INTERVAL_SECONDS", "600"))
+
+
+class QueryImage:
+    """
+    An uploaded image held in memory: the raw bytes (for content hashing) and one decoded RGB copy
+    shared by every pipeline stage. The pixels are fully loaded up front, so concurrent stages
+    only ever read them.
+    """
+
+    def __init__(self, image_bytes, filename, filepath=None):
+        self.image_bytes = image_bytes
+        self.filename = filename
+        self.filepath = filepath # Set once persisted to UPLOAD_FOLDER
+        with Image.open(io.BytesIO(image_bytes)) as raw_img:
+            self.image = raw_img.convert("RGB")
+        self.image.load()
+
+    @classmethod
+    def from_file_storage(cls, file_storage, filename):
+        return cls(file_storage.read(), filename)
+
+    def persist(self, upload_dir):
+        """Writes the original bytes to `upload_dir` and returns the path."""
+        filepath = os.path.join(upload_dir, self.filename)
+        with open(filepath, "wb") as f:
+            f.write(self.image_bytes)
+        self.filepath = filepath
+        return filepath
+
+
+def reap_uploads(upload_dir, max_age_seconds=UPLOAD_MAX_AGE_SECONDS, max_total_bytes=UPLOAD_MAX_TOTAL_MB * 1024 * 1024):
+    """
+    Deletes uploads older than `max_age_seconds`, then the oldest remaining ones until the folder
+    fits in `max_total_bytes`. Returns (files removed, bytes freed).
+    """
+    files = []
+    try:
+        with os.scandir(upload_dir) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+    except FileNotFoundError:
+        return 0, 0
+
+    files.sort() # Oldest first
+    total_bytes = sum(size for _, size, _ in files)
+    cutoff = time.time() - max_age_seconds
+    removed, freed = 0, 0
+    for mtime, size, path in files:
+        if mtime >= cutoff and total_bytes <= max_total_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError as e:
+            current_app.logger.warning(f"Could not remove old upload {path}: {e}")
+            continue
+        total_bytes -= size
+        removed += 1
+        freed += size
+    return removed, freed
+
+def start_upload_reaper(flask_app, upload_dir):
+    """Starts a daemon thread that enforces the age/size quota on `upload_dir`."""
+    def reap_loop():
+        while True:
+            with flask_app.app_context():
+                try:
+                    removed, freed = reap_uploads(upload_dir)
+                    if removed:
+                        current_app.logger.info(f"Upload reaper removed {removed} files ({freed / 1024 / 1024:.1f} MB).")
+                except Exception as e:
+                    current_app.logger.error(f"Upload reaper failed: {e}", exc_info=True)
+            time.sleep(UPLOAD_REAPER_INTERVAL_SECONDS)
+
+    reaper = threading.Thread(target=reap_loop, name="upload-reaper", daemon=True)
+    reaper.start()
+    return reaper
@@ -0,0 +1,83 @@
+# backend_flask/warmup.py
+import os
+import threading
+import time
+from flask import current_app
+
+# "background": the app serves requests as soon as it is imported while models and the catalog load
+# on a thread. "eager": everything loads before the import finishes (scripts).
+# "preload": eager, and the app's background threads are left for each forked worker to start
+# (gunicorn.conf.py), so all workers share the master's copy of the models and catalog.
+WARM_UP_MODE = os.getenv("WARM_UP_MODE", "background").lower()
+WARM_UP_RETRY_DELAY_SECONDS = float(os.getenv("WARM_UP_RETRY_DELAY_SECONDS", "2")) # Doubles after each failed attempt
+
+
+class WarmUp:
+    """
+    Runs the app's slow start-up steps (model loading, catalog, caches) in order and records the state
+    of each for /readyz. A step may return False to report that it finished degraded (e.g. an optional
+    model is unavailable); an exception retries the step up to its `retries` times with backoff, then marks
+    it failed and the remaining steps still run. The app is ready once every step has finished and no
+    required step failed. A failed step is marked ok if something later does its job (mark_ok).
+    """
+
+    def __init__(self):
+        self.steps = [] # (name, fn, required, retries)
+        self.state = {} # step name -> {"status": pending|running|ok|degraded|failed, "ms", "error"}
+        self.started_at = None
+        self.finished_at = None
+        self._done = threading.Event()
+
+    def add(self, name, fn, required=False, retries=0):
+        self.steps.append((name, fn, required, retries))
+        self.state[name] = {"status": "pending"}
+        return self
+
+    def run(self, flask_app):
+        self.started_at = time.time()
+        with flask_app.app_context():
+            for name, fn, _, retries in self.steps:
+                self.state[name] = {"status": "running"}
+                start = time.perf_counter()
+                for attempt in range(retries + 1):
+                    try:
+                        status = "degraded" if fn() is False else "ok"
+                        error = None
+                        break
+                    except Exception as e:
+                        current_app.logger.error(f"Warm-up step '{name}' failed (attempt {attempt + 1} of {retries + 1}): {e}",
+                                                 exc_info=True)
+                        status, error = "failed", str(e)
+                        if attempt < retries:
+                            time.sleep(WARM_UP_RETRY_DELAY_SECONDS * 2 ** attempt)
+                self.state[name] = {"status": status, "ms": round(1000.0 * (time.perf_counter() - start), 1)}
+                if error:
+                    self.state[name]["error"] = error
+            self.finished_at = time.time()
+            self._done.set()
+            current_app.logger.info(f"Warm-up finished in {self.finished_at - self.started_at:.1f}s: "
+                                    + ", ".join(f"{name}={s['status']}" for name, s in self.state.items()))
+
+    def start(self, flask_app, background=True):
+        """Runs the steps on a daemon thread, or inline when `background` is False."""
+        if not background:
+            self.run(flask_app)
+            return None
+        thread = threading.Thread(target=self.run, args=(flask_app,), name="warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def mark_ok(self, name):
+        """Marks a failed step ok, e.g. once a later catalog reload has published the catalog it failed to load."""
+        if self.state.get(name, {}).get("status") == "failed":
+            self.state[name] = {"status": "ok", "recovered_at": time.time()}
+
+    def is_ready(self):
+        return self._done.is_set() and all(self.state[name]["status"] != "failed" for name, _, required, _ in self.steps if required)
+
+    def get_status(self):
+        return {
+            "ready": self.is_ready(), "finished": self._done.is_set(),
+            "started_at": self.started_at, "finished_at": self.finished_at,
+            "steps": {name: dict(state) for name, state in self.state.items()},
+        }
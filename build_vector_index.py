@@ -0,0 +1,87 @@
+import argparse
+import json
+import os
+import numpy as np
+from flask import Flask
+
+from backend_flask.ai_core.embedding_cache import load_embedding_cache, verify_embedding_cache
+from backend_flask.ai_core.vector_index import build_index, evaluate_recall, INDEX_TYPES
+from backend_flask.ai_core.vision_models import VIT_EMBEDDING_SPACE # Honours VIT_INFERENCE_MODE like the app
+
+# --- Configuration ---
+# Paths relative to where this script (build_vector_index.py) is run from (project root)
+BACKEND_FLASK_DIR = "backend_flask"
+VECTOR_INDEX_DIR = os.path.join(BACKEND_FLASK_DIR, "vector_index") # Must match product_catalog.VECTOR_INDEX_DIR_RELATIVE
+# --- End Configuration ---
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build an approximate nearest-neighbour index over the catalog ViT embedding cache.")
+    parser.add_argument("--kind", choices=[k for k in INDEX_TYPES if k != "flat"], default="ivf")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF: number of k-means lists (default 4*sqrt(N))")
+    parser.add_argument("--nprobe", type=int, default=8, help="IVF: lists scanned per query")
+    parser.add_argument("--M", type=int, default=16, help="HNSW: graph degree")
+    parser.add_argument("--ef-construction", type=int, default=200, help="HNSW: build-time candidate list size")
+    parser.add_argument("--ef-search", type=int, default=64, help="HNSW: query-time candidate list size")
+    parser.add_argument("--k", type=int, default=10, help="k for the recall@k report")
+    parser.add_argument("--queries", type=int, default=200, help="Number of sampled queries for the recall report")
+    parser.add_argument("--verify-cache", action="store_true", help="Hash the whole cached matrix against its manifest first")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    print(f"--- Building '{args.kind}' vector index ---")
+
+    # embedding_cache logs through current_app, so give it a minimal app rooted at backend_flask
+    app = Flask(__name__, root_path=os.path.abspath(BACKEND_FLASK_DIR))
+    with app.app_context():
+        if args.verify_cache:
+            verified = verify_embedding_cache()
+            if verified is False:
+                print("ERROR: The cached embedding matrix does not match its manifest's digest. Delete the cache and restart the app.")
+                return
+            print("Embedding cache digest OK." if verified else "Embedding cache has no digest to verify; continuing.")
+        entries, matrix = load_embedding_cache(VIT_EMBEDDING_SPACE)
+    if matrix is None or not entries:
+        print("ERROR: No embedding cache found. Start the app once to embed the catalog, then re-run this script.")
+        return
+
+    ids = np.array(sorted(entries, key=lambda pid: entries[pid]["row"]))
+    vectors = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors = np.ascontiguousarray(vectors / norms)
+    print(f"Loaded {vectors.shape[0]} embeddings of dimension {vectors.shape[1]}.")
+
+    if args.kind == "ivf":
+        index = build_index("ivf", vectors, ids, nlist=args.nlist, nprobe=args.nprobe)
+        knob_name, knob_values = "nprobe", sorted({1, 2, 4, 8, 16, 32, args.nprobe})
+    else:
+        index = build_index("hnsw", vectors, ids, M=args.M, ef_construction=args.ef_construction, ef_search=args.ef_search)
+        knob_name, knob_values = "ef_search", sorted({16, 32, 64, 128, 256, args.ef_search})
+
+    output_dir = os.path.join(VECTOR_INDEX_DIR, args.kind)
+    index.save(output_dir)
+    print(f"Saved index to {output_dir}: {index.describe()}")
+
+    # Recall@k against exact search, sweeping the query-time knob
+    index.attach(vectors, ids)
+    print(f"\nRecall@{args.k} vs exact search ({min(args.queries, len(ids))} sampled catalog queries):")
+    print(f"{knob_name:>10} {'recall':>8} {'exact ms':>10} {'index ms':>10}")
+    report = []
+    for value in knob_values:
+        if args.kind == "ivf":
+            index.nprobe = value
+        else:
+            index.set_ef_search(value)
+        result = evaluate_recall(index, vectors, k=args.k, num_queries=args.queries)
+        report.append({knob_name: value, **result})
+        print(f"{value:>10} {result['recall_at_k']:>8.3f} {result['exact_ms_per_query']:>10.3f} {result['index_ms_per_query']:>10.3f}")
+
+    with open(os.path.join(output_dir, "recall_report.json"), "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nRecall report written to {os.path.join(output_dir, 'recall_report.json')}")
+    print(f"Enable with VECTOR_INDEX_TYPE={args.kind} (tune with "
+          f"{'IVF_NPROBE' if args.kind == 'ivf' else 'HNSW_EF_SEARCH'}).")
+
+if __name__ == "__main__":
+    main()
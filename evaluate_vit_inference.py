@@ -0,0 +1,121 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+from PIL import Image
+
+from backend_flask.ai_core.vision_models import (
+    build_vit_model, vit_forward, configure_torch_threads, VIT_INFERENCE_MODES, VIT_MODEL_NAME
+)
+
+# --- Configuration ---
+# Paths relative to where this script (evaluate_vit_inference.py) is run from (project root)
+BACKEND_FLASK_DIR = "backend_flask"
+CATALOG_FILE = os.path.join(BACKEND_FLASK_DIR, "curated_product_catalog.json")
+REPORT_DIR = os.path.join(BACKEND_FLASK_DIR, "embedding_cache")
+# --- End Configuration ---
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare a low-latency ViT inference mode against fp32 on catalog images "
+                                                 "(embedding drift, top-k neighbour recall, latency).")
+    parser.add_argument("--mode", choices=[m for m in VIT_INFERENCE_MODES if m != "fp32"], default="int8")
+    parser.add_argument("--images", type=int, default=500, help="Catalog images to embed with both modes")
+    parser.add_argument("--k", type=int, default=10, help="k for the neighbour recall@k report")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--latency-samples", type=int, default=20, help="Single-image forward passes timed per mode")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser.parse_args()
+
+def load_pixel_values(processor, num_images, seed):
+    """Preprocesses a random sample of catalog images once; both modes embed the same pixels."""
+    with open(CATALOG_FILE, "r") as f:
+        products = json.load(f)
+    paths = [os.path.join(BACKEND_FLASK_DIR, p["image_path_for_ai"]) for p in products
+             if p.get("image_path_for_ai") and os.path.exists(os.path.join(BACKEND_FLASK_DIR, p["image_path_for_ai"]))]
+    rng = np.random.default_rng(seed)
+    paths = [paths[i] for i in sorted(rng.choice(len(paths), size=min(num_images, len(paths)), replace=False))]
+    pixels = []
+    for path in paths:
+        with Image.open(path) as raw_img:
+            pixels.append(processor(images=raw_img.convert("RGB"), return_tensors="np")["pixel_values"][0])
+    return np.stack(pixels)
+
+def embed(model, device, mode, pixels, batch_size, latency_samples):
+    """Returns (L2-normalized embeddings, batched ms per image, single-image ms per image)."""
+    import torch
+    vit_forward(model, torch.from_numpy(pixels[:1]).to(device), mode) # Warm-up pass
+    start = time.perf_counter()
+    batches = [vit_forward(model, torch.from_numpy(pixels[i:i + batch_size]).to(device), mode)
+               for i in range(0, len(pixels), batch_size)]
+    batched_ms = 1000.0 * (time.perf_counter() - start) / len(pixels)
+
+    samples = min(latency_samples, len(pixels))
+    start = time.perf_counter()
+    for i in range(samples):
+        vit_forward(model, torch.from_numpy(pixels[i:i + 1]).to(device), mode)
+    single_ms = 1000.0 * (time.perf_counter() - start) / max(1, samples)
+
+    vectors = np.vstack(batches).astype(np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms, batched_ms, single_ms
+
+def neighbour_recall(reference, queries, catalog, k):
+    """
+    Mean overlap between each image's top-k neighbours under fp32 (`reference` against itself) and
+    under `queries` searched against `catalog`. The image itself is excluded from both lists.
+    """
+    hits = 0
+    for row in range(reference.shape[0]):
+        expected_scores = reference @ reference[row]
+        found_scores = catalog @ queries[row]
+        expected_scores[row] = found_scores[row] = -np.inf
+        hits += len(set(np.argsort(-expected_scores)[:k].tolist()) & set(np.argsort(-found_scores)[:k].tolist()))
+    return hits / max(1, reference.shape[0] * min(k, reference.shape[0] - 1))
+
+def main():
+    args = parse_args()
+    threads = configure_torch_threads()
+    print(f"--- ViT inference check: fp32 vs {args.mode} ({VIT_MODEL_NAME}, {threads[0]} intra-op threads) ---")
+
+    processor, fp32_model, fp32_device = build_vit_model("fp32")
+    pixels = load_pixel_values(processor, args.images, args.seed)
+    if len(pixels) < 2:
+        print("ERROR: Not enough catalog images found. Run prepare_dataset.py first.")
+        return
+    print(f"Embedding {len(pixels)} catalog images with both modes...")
+    reference, fp32_batched_ms, fp32_single_ms = embed(fp32_model, fp32_device, "fp32", pixels, args.batch_size, args.latency_samples)
+    del fp32_model
+    _, candidate_model, candidate_device = build_vit_model(args.mode)
+    candidate, batched_ms, single_ms = embed(candidate_model, candidate_device, args.mode, pixels, args.batch_size, args.latency_samples)
+
+    cosines = np.sum(reference * candidate, axis=1)
+    report = {
+        "model": VIT_MODEL_NAME, "mode": args.mode, "images": int(len(pixels)), "k": args.k,
+        "intra_op_threads": threads[0], "inter_op_threads": threads[1],
+        "cosine_to_fp32_mean": float(cosines.mean()), "cosine_to_fp32_min": float(cosines.min()),
+        # Catalog and queries both embedded in the new mode (what the app does once the mode is enabled)
+        "recall_at_k": neighbour_recall(reference, candidate, candidate, args.k),
+        # New-mode queries against an fp32 catalog (a catalog cache that was not re-embedded)
+        "recall_at_k_vs_fp32_catalog": neighbour_recall(reference, candidate, reference, args.k),
+        "fp32_ms_per_image_batched": fp32_batched_ms, "ms_per_image_batched": batched_ms,
+        "fp32_ms_single_image": fp32_single_ms, "ms_single_image": single_ms,
+    }
+
+    print(f"\n{'':>24} {'fp32':>10} {args.mode:>10}")
+    print(f"{'batched ms/image':>24} {fp32_batched_ms:>10.2f} {batched_ms:>10.2f}   ({fp32_batched_ms / batched_ms:.2f}x)")
+    print(f"{'single-image ms':>24} {fp32_single_ms:>10.2f} {single_ms:>10.2f}   ({fp32_single_ms / single_ms:.2f}x)")
+    print(f"\nCosine similarity to fp32 embeddings: mean {report['cosine_to_fp32_mean']:.4f}, min {report['cosine_to_fp32_min']:.4f}")
+    print(f"Top-{args.k} neighbour recall vs fp32: {report['recall_at_k']:.3f} "
+          f"(against an fp32 catalog: {report['recall_at_k_vs_fp32_catalog']:.3f})")
+
+    os.makedirs(REPORT_DIR, exist_ok=True)
+    report_path = os.path.join(REPORT_DIR, f"vit_inference_report_{args.mode}.json")
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nReport written to {report_path}")
+    print(f"Enable with VIT_INFERENCE_MODE={args.mode} (the catalog is re-embedded once into its own cache).")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,29 @@
+# Gunicorn settings for serving ShopSmarter with several worker processes. Run from the project root:
+#   gunicorn -c gunicorn.conf.py backend_flask.app:app
+#
+# The master imports the app once (WARM_UP_MODE=preload: models, catalog and homepage load before forking),
+# then forks the workers. They share its ViT weights and the read-only memory-mapped catalog matrix
+# (embedding_cache/catalog_matrix/) instead of each loading their own, and start their background
+# threads after the fork. Catalog hot reloads still happen per worker (see app.py).
+import gc
+import os
+
+os.environ.setdefault("WARM_UP_MODE", "preload") # Read when the app module is imported, so set it first
+
+bind = os.getenv("GUNICORN_BIND", "127.0.0.1:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+threads = int(os.getenv("GUNICORN_THREADS", "4"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+preload_app = True
+
+# Split the cores between the workers' torch thread pools rather than letting each one claim all of them
+os.environ.setdefault("VIT_NUM_THREADS", str(max(1, (os.cpu_count() or 1) // workers)))
+
+def when_ready(server):
+    # Move everything the preload allocated out of the collector's generations: otherwise the first
+    # collection in each worker touches every object header and copies those pages into the worker.
+    gc.freeze()
+
+def post_fork(server, worker):
+    from backend_flask.app import app, start_background_tasks
+    start_background_tasks(app)